@@ -0,0 +1,136 @@
+import numpy as np
+from calendar_array import EPOCH_WEEKDAY, WEEKDAYS
+
+
+def day_number(day):
+    # Days since 1970-01-01 for a date or ISO date string.
+    return int(np.datetime64(day, "D").astype(np.int64))
+
+
+def day_strings(days):
+    return np.datetime_as_string(days.astype("datetime64[D]"), unit="D").tolist()
+
+
+class AvailabilityIndex:
+    # Pickup dates per Seenons stream ID as sorted int32 arrays of day numbers (days since
+    # 1970-01-01, like CalendarArray). Next pickup and date range queries are a binary search
+    # in the stream's array. For weekday queries a stream's days are also ordered by weekday
+    # and then date, with the offsets of the 7 weekday segments, so a weekday is a slice
+    # searched the same way. That order is built on the first weekday query of the stream.
+    # Dates are returned as ISO date strings.
+    __slots__ = ("days", "_by_weekday")
+
+    def __init__(self, days):
+        # Mapping of stream ID to the day numbers of its pickups (in any order).
+        self.days = {
+            stream_id: np.sort(np.asarray(stream_days, dtype=np.int32))
+            for stream_id, stream_days in days.items()
+        }
+        # (days ordered by weekday, segment offsets) per stream ID, see _weekday_order.
+        self._by_weekday = {}
+
+    @classmethod
+    def from_calendar(cls, calendar, stream_ids=None):
+        # Build from a CalendarArray, keeping only the given stream IDs if any.
+        if stream_ids is not None:
+            calendar = calendar.filter(calendar.stream_mask(stream_ids))
+        days = calendar.dates.astype(np.int64)
+        return cls(
+            {
+                stream_id: days[calendar.stream_ids == stream_id]
+                for stream_id in dict.fromkeys(calendar.stream_ids.tolist())
+            }
+        )
+
+    def __len__(self):
+        return len(self.days)
+
+    def __contains__(self, stream_id):
+        return stream_id in self.days
+
+    def stream_ids(self):
+        return list(self.days)
+
+    def next_pickup(self, stream_id, day):
+        # First pickup of the stream on or after day, None if there is none.
+        stream_days = self.days.get(stream_id)
+        if stream_days is None:
+            return None
+        i = np.searchsorted(stream_days, day_number(day))
+        if i == len(stream_days):
+            return None
+        return str(np.datetime64(int(stream_days[i]), "D"))
+
+    def pickups_in_range(self, stream_id, start, end):
+        # Pickups of the stream from start up to and including end.
+        stream_days = self.days.get(stream_id)
+        if stream_days is None:
+            return []
+        return day_strings(self._range(stream_days, start, end))
+
+    def pickups_on_weekdays(self, stream_id, weekdays, start=None, end=None):
+        # Pickups of the stream on the given weekday names (case insensitive, unknown names
+        # ignored), optionally only those from start up to and including end.
+        if stream_id not in self.days:
+            return []
+        by_weekday, offsets = self._weekday_order(stream_id)
+        numbers = sorted(
+            {
+                WEEKDAYS.index(weekday.capitalize())
+                for weekday in weekdays
+                if weekday.capitalize() in WEEKDAYS
+            }
+        )
+        segments = []
+        for number in numbers:
+            first, last = offsets[number], offsets[number + 1]
+            segments.append(self._range(by_weekday[first:last], start, end))
+        if not segments:
+            return []
+        return day_strings(np.sort(np.concatenate(segments)))
+
+    def _weekday_order(self, stream_id):
+        if stream_id not in self._by_weekday:
+            stream_days = self.days[stream_id]
+            weekdays = (stream_days + EPOCH_WEEKDAY) % 7
+            # Stable sort keeps the days of each weekday in date order.
+            order = np.argsort(weekdays, kind="stable")
+            self._by_weekday[stream_id] = (
+                stream_days[order],
+                np.searchsorted(weekdays[order], np.arange(8)),
+            )
+        return self._by_weekday[stream_id]
+
+    def _range(self, stream_days, start, end):
+        first = 0 if start is None else np.searchsorted(stream_days, day_number(start))
+        last = (
+            len(stream_days)
+            if end is None
+            else np.searchsorted(stream_days, day_number(end), side="right")
+        )
+        return stream_days[first:last]
+
+    def to_availability_dict(self):
+        # Available dates per stream ID, as returned by Integration.create_availability_dict.
+        return {
+            stream_id: day_strings(stream_days)
+            for stream_id, stream_days in self.days.items()
+        }
+
+    def to_dict(self):
+        # JSON serializable form with the day numbers (keys are strings in JSON).
+        return {
+            "streams": {
+                str(stream_id): stream_days.tolist()
+                for stream_id, stream_days in self.days.items()
+            }
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            {
+                int(stream_id): stream_days
+                for stream_id, stream_days in data["streams"].items()
+            }
+        )
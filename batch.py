@@ -0,0 +1,230 @@
+import argparse
+import csv
+import json
+import sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from integration_API import SeenonsAPI, create_session
+from resolver import AddressResolver
+from response_cache import ResponseCache
+from calendar_store import CalendarStore, OfflineHagueAPI
+from models import HagueStream, CollectionDate, from_payloads
+from parallel import integrate_parallel
+from transport import Transport
+from municipalities import create_router
+
+DEFAULT_WORKERS = 16
+
+
+def read_addresses(path):
+    # Read addresses from a CSV (with header) or JSONL file with postcode, housenumber and optional houseletter.
+    with open(path, newline="") as addresses_file:
+        if path.endswith(".jsonl"):
+            rows = (json.loads(line) for line in addresses_file if line.strip())
+        else:
+            rows = csv.DictReader(addresses_file)
+        for row in rows:
+            # Only a missing column (or JSON null) means no house letter was given, an empty
+            # one selects the address without a letter.
+            house_letter = row.get("houseletter")
+            yield {
+                "postcode": str(row["postcode"]).strip(),
+                "housenumber": str(row["housenumber"]).strip(),
+                "houseletter": house_letter.strip()
+                if house_letter is not None
+                else None,
+            }
+
+
+def resolve_address(resolver, address, weekdays=None, start=None, end=None):
+    # Resolve one address, turning upstream failures into an error record so the batch keeps going.
+    try:
+        return resolver.resolve(
+            address["postcode"],
+            address["housenumber"],
+            address["houseletter"],
+            weekdays,
+            start,
+            end,
+        )
+    except (requests.RequestException, ValueError, LookupError) as error:
+        return {**address, "error": f"{type(error).__name__}: {error}"}
+
+
+def fetch_address(resolver, address):
+    # Fetch the integration inputs of one address (see AddressResolver.fetch), turning
+    # upstream failures into an error record. Only the HagueStream and CollectionDate models
+    # are kept, which also reads streamed calendars here rather than in the worker processes.
+    try:
+        record, documents, stream_types = resolver.fetch(
+            address["postcode"], address["housenumber"], address["houseletter"]
+        )
+    except (requests.RequestException, ValueError, LookupError) as error:
+        return {**address, "error": f"{type(error).__name__}: {error}"}, None, None
+    if documents is not None:
+        hague_waste_streams, hague_dates, seenons_stream_ids = documents
+        documents = (
+            from_payloads(HagueStream, hague_waste_streams),
+            from_payloads(CollectionDate, hague_dates),
+            seenons_stream_ids,
+        )
+    return record, documents, stream_types
+
+
+def map_ordered(fn, items, workers=DEFAULT_WORKERS):
+    # Apply fn to the items on a bounded thread pool, yielding the results in input order.
+    # At most workers * 4 items are in flight so memory stays flat for large inputs.
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(fn, item))
+            if len(pending) >= workers * 4:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def resolve_batch(
+    resolver, addresses, weekdays=None, workers=DEFAULT_WORKERS, start=None, end=None
+):
+    # Resolve addresses on a bounded thread pool, yielding records in input order,
+    # optionally with only the dates from start up to and including end.
+    return map_ordered(
+        lambda address: resolve_address(resolver, address, weekdays, start, end),
+        addresses,
+        workers,
+    )
+
+
+def resolve_batch_parallel(
+    resolver, addresses, weekdays=None, workers=DEFAULT_WORKERS, processes=None
+):
+    # Like resolve_batch, with the CPU bound integration spread over worker processes
+    # (see parallel.py): threads fetch, processes integrate. Records keep input order.
+    fetched = map_ordered(
+        lambda address: fetch_address(resolver, address), addresses, workers
+    )
+    items = (
+        ((record, stream_types), documents)
+        for record, documents, stream_types in fetched
+    )
+    results = integrate_parallel(
+        resolver.get_stream_mapping(), items, weekdays, processes
+    )
+    for (record, stream_types), available_streams in results:
+        if available_streams is not None:
+            resolver.add_streams(record, available_streams, stream_types)
+        yield record
+
+
+def main(
+    input_path,
+    output_path=None,
+    weekdays=None,
+    workers=DEFAULT_WORKERS,
+    cache_path=None,
+    store_path=None,
+    streaming=False,
+    processes=None,
+    rate=None,
+    municipalities_path=None,
+):
+    # All APIs share one transport, so the rate limit and circuit state are per host.
+    session = Transport(create_session(workers), rate=rate)
+    cache = ResponseCache(cache_path) if cache_path else None
+    # With a calendar store the Huisvuilkalendar API is not queried at all.
+    if store_path:
+        hague_api = OfflineHagueAPI(CalendarStore(store_path))
+    else:
+        # Calendar lookups are routed to the backend of the address' municipality.
+        hague_api = create_router(municipalities_path, session, cache)
+    resolver = AddressResolver(
+        SeenonsAPI(session, cache=cache), hague_api, streaming=streaming
+    )
+    output = open(output_path, "w") if output_path else sys.stdout
+    try:
+        addresses = read_addresses(input_path)
+        if processes:
+            records = resolve_batch_parallel(
+                resolver, addresses, weekdays, workers, processes
+            )
+        else:
+            records = resolve_batch(resolver, addresses, weekdays, workers)
+        for record in records:
+            output.write(json.dumps(record) + "\n")
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-i", "--input", help="CSV or JSONL file with addresses", required=True
+    )
+    parser.add_argument(
+        "-o", "--output", help="JSONL output file (default stdout)", required=False
+    )
+    parser.add_argument(
+        "-wd",
+        "--weekday",
+        nargs="+",
+        help="Weekdays (Monday, Tuesday etc...)",
+        required=False,
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help="Number of concurrent lookups",
+    )
+    parser.add_argument(
+        "-c", "--cache", help="SQLite file to cache API responses in", required=False
+    )
+    parser.add_argument(
+        "-s",
+        "--store",
+        help="Calendar store to answer Huisvuilkalendar lookups from (see calendar_store.py)",
+        required=False,
+    )
+    parser.add_argument(
+        "--streaming",
+        action="store_true",
+        help="Parse the catalogue and calendars while they download (bypasses the cache)",
+    )
+    parser.add_argument(
+        "-p",
+        "--processes",
+        type=int,
+        help="Integrate on this many worker processes (for large, cached batches)",
+        required=False,
+    )
+    parser.add_argument(
+        "-r",
+        "--rate",
+        type=float,
+        help="Maximum requests per second to each upstream API",
+        required=False,
+    )
+    parser.add_argument(
+        "-m",
+        "--municipalities",
+        help="JSON file with the municipalities and their calendar APIs (default Den Haag)",
+        required=False,
+    )
+    args = parser.parse_args()
+
+    main(
+        args.input,
+        args.output,
+        args.weekday,
+        args.workers,
+        args.cache,
+        args.store,
+        args.streaming,
+        args.processes,
+        args.rate,
+        args.municipalities,
+    )
@@ -0,0 +1,216 @@
+import argparse
+import contextlib
+import io
+import json
+import statistics
+import sys
+import time
+from datetime import date
+from integration_API import SeenonsAPI, HagueAPI, Integration, create_session
+from resolver import AddressResolver
+from batch import resolve_batch, resolve_batch_parallel, DEFAULT_WORKERS
+from stub_server import StubServer, fixture_routes, load_fixture
+import user_interface
+
+DEFAULT_SIZES = [1, 100, 10000]
+# A metric may be this much slower than its baseline before it counts as a regression.
+DEFAULT_TOLERANCE = 1.5
+
+
+def synthetic_routes(count, year=None):
+    # Stub routes for count addresses spread over 100 post codes, each with its own bag ID,
+    # replaying the recorded Seenons and Huisvuilkalendar responses.
+    year = year if year is not None else date.today().year
+    routes = fixture_routes(year)
+    seenons_streams = load_fixture("seenons_streams_2512HE.json")
+    waste_streams = load_fixture("afvalstromen.json")
+    hague_dates = load_fixture("kalender.json")
+    addresses = []
+    for i in range(count):
+        post_code, house_number = f"{2500 + i % 100}AB", str(1 + i // 100)
+        bag_id = f"0518{i:012d}"
+        addresses.append(
+            {"postcode": post_code, "housenumber": house_number, "houseletter": None}
+        )
+        routes[f"/api/me/streams?postal_code={post_code}"] = seenons_streams
+        routes[f"/adressen/{post_code}:{house_number}"] = [
+            {"bagid": bag_id, "postcode": post_code, "huisletter": ""}
+        ]
+        routes[f"/rest/adressen/{bag_id}/afvalstromen"] = waste_streams
+        routes[f"/rest/adressen/{bag_id}/kalender/{year}"] = hague_dates
+    return routes, addresses
+
+
+def time_calls(fn, repeat):
+    # Seconds per call, for each of repeat calls.
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def summarise(timings):
+    timings = sorted(timings)
+    return {
+        "median_ms": statistics.median(timings) * 1000,
+        "p95_ms": timings[int(0.95 * (len(timings) - 1))] * 1000,
+    }
+
+
+def benchmark_stages(repeat=200):
+    # Time each integration stage on the recorded calendar.
+    integration = Integration()
+    hague_waste_streams = load_fixture("afvalstromen.json")
+    all_seenons_waste_streams = load_fixture("seenons_streams.json")
+    hague_dates = load_fixture("kalender.json")
+    seenons_stream_ids = [17, 1, 3]
+    modified = integration.modify_hague_stream_dates(
+        hague_waste_streams, all_seenons_waste_streams, hague_dates
+    )
+    with_weekdays = integration.add_weekday_to_hague_dates(modified)
+    calendar = integration.create_calendar_array(
+        hague_waste_streams, all_seenons_waste_streams, hague_dates
+    )
+    stages = {
+        "modify_hague_stream_dates": lambda: integration.modify_hague_stream_dates(
+            hague_waste_streams, all_seenons_waste_streams, hague_dates
+        ),
+        "add_weekday_to_hague_dates": lambda: integration.add_weekday_to_hague_dates(
+            modified
+        ),
+        "create_availability_dict": lambda: integration.create_availability_dict(
+            with_weekdays, seenons_stream_ids
+        ),
+        "create_calendar_array": lambda: integration.create_calendar_array(
+            hague_waste_streams, all_seenons_waste_streams, hague_dates
+        ),
+        "create_availability_dict_array": lambda: integration.create_availability_dict(
+            calendar, seenons_stream_ids
+        ),
+    }
+    return {name: summarise(time_calls(fn, repeat)) for name, fn in stages.items()}
+
+
+def benchmark_user_interface(stub, repeat=20):
+    # End-to-end latency of user_interface.main against the stub (output discarded).
+    session = create_session()
+    user_interface.seenons_api = SeenonsAPI(session, stub.seenons_url)
+    user_interface.hague_api = HagueAPI(session, stub.hague_url)
+    with contextlib.redirect_stdout(io.StringIO()):
+        # Address 2500AB 1 has a single house letter, so nothing is prompted.
+        timings = time_calls(lambda: user_interface.main("2500AB", "1"), repeat)
+    return summarise(timings)
+
+
+def benchmark_batch(stub, addresses, workers=DEFAULT_WORKERS, processes=None):
+    # Throughput of a batch run with a fresh resolver (so nothing is shared between runs),
+    # integrating on worker processes if given.
+    session = create_session(workers)
+    resolver = AddressResolver(
+        SeenonsAPI(session, stub.seenons_url), HagueAPI(session, stub.hague_url)
+    )
+    started = time.perf_counter()
+    if processes:
+        records = list(
+            resolve_batch_parallel(resolver, addresses, None, workers, processes)
+        )
+    else:
+        records = list(resolve_batch(resolver, addresses, workers=workers))
+    elapsed = time.perf_counter() - started
+    errors = sum("error" in record for record in records)
+    if errors:
+        raise RuntimeError(f"{errors} addresses failed during the benchmark")
+    return {"seconds": elapsed, "addresses_per_second": len(records) / elapsed}
+
+
+def run(sizes=DEFAULT_SIZES, workers=DEFAULT_WORKERS, processes=None):
+    routes, addresses = synthetic_routes(max(sizes))
+    results = {"stages": benchmark_stages()}
+    with StubServer(routes) as stub:
+        results["user_interface"] = benchmark_user_interface(stub)
+        results["batch"] = {
+            str(size): benchmark_batch(stub, addresses[:size], workers, processes)
+            for size in sizes
+        }
+    return results
+
+
+def find_regressions(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    # Metrics that got worse than baseline by more than the tolerance factor.
+    regressions = []
+    for name, summary in results["stages"].items():
+        old = baseline.get("stages", {}).get(name)
+        if old and summary["median_ms"] > old["median_ms"] * tolerance:
+            regressions.append(f"stage {name}: {summary['median_ms']:.3f} ms")
+    old = baseline.get("user_interface")
+    new = results["user_interface"]
+    if old and new["median_ms"] > old["median_ms"] * tolerance:
+        regressions.append(f"user_interface.main: {new['median_ms']:.3f} ms")
+    for size, summary in results["batch"].items():
+        old = baseline.get("batch", {}).get(size)
+        rate = summary["addresses_per_second"]
+        if old and rate * tolerance < old["addresses_per_second"]:
+            regressions.append(f"batch of {size}: {rate:.0f} addresses/s")
+    return regressions
+
+
+def print_results(results):
+    for name, summary in results["stages"].items():
+        print(
+            f"{name}: median {summary['median_ms']:.3f} ms, p95 {summary['p95_ms']:.3f} ms"
+        )
+    summary = results["user_interface"]
+    print(
+        f"user_interface.main: median {summary['median_ms']:.2f} ms, p95 {summary['p95_ms']:.2f} ms"
+    )
+    for size, summary in results["batch"].items():
+        print(
+            f"batch of {size}: {summary['seconds']:.2f} s, {summary['addresses_per_second']:.0f} addresses/s"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=DEFAULT_SIZES,
+        help="Batch sizes to measure throughput for",
+    )
+    parser.add_argument(
+        "-w", "--workers", type=int, default=DEFAULT_WORKERS, help="Batch workers"
+    )
+    parser.add_argument(
+        "-p",
+        "--processes",
+        type=int,
+        help="Integrate batches on this many worker processes",
+    )
+    parser.add_argument("-o", "--output", help="Write results as JSON to this file")
+    parser.add_argument(
+        "-b", "--baseline", help="JSON results of an earlier run to compare against"
+    )
+    parser.add_argument(
+        "-t",
+        "--tolerance",
+        type=float,
+        default=DEFAULT_TOLERANCE,
+        help="Allowed slowdown factor compared to the baseline",
+    )
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.workers, args.processes)
+    print_results(results)
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            regressions = find_regressions(results, json.load(baseline), args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
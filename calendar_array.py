@@ -0,0 +1,86 @@
+import numpy as np
+from models import CollectionDate
+
+WEEKDAYS = [
+    "Monday",
+    "Tuesday",
+    "Wednesday",
+    "Thursday",
+    "Friday",
+    "Saturday",
+    "Sunday",
+]
+# Day 0 of datetime64[D] (1970-01-01) was a Thursday.
+EPOCH_WEEKDAY = 3
+
+
+class CalendarArray:
+    # Column oriented Huisvuilkalendar calendar: collection dates as datetime64[D] and
+    # stream IDs as integers. Weekdays are computed and filtered on the whole array at once,
+    # names and date strings are only formatted when producing output.
+    __slots__ = ("dates", "stream_ids")
+
+    def __init__(self, dates, stream_ids):
+        self.dates = np.asarray(dates, dtype="datetime64[D]")
+        self.stream_ids = np.asarray(stream_ids, dtype=np.int64)
+
+    @classmethod
+    def from_hague_dates(cls, hague_dates):
+        # Build from the 'kalender' entries of the Huisvuilkalendar API (dicts or an iterable of them)
+        # or from CollectionDates.
+        dates = []
+        stream_ids = []
+        for item in hague_dates:
+            if isinstance(item, CollectionDate):
+                dates.append(item.date)
+                stream_ids.append(item.stream_id)
+            else:
+                dates.append(item["ophaaldatum"])
+                stream_ids.append(item["afvalstroom_id"])
+        # NumPy parses the ISO date strings itself, no strptime per entry.
+        return cls(np.array(dates, dtype="datetime64[D]"), stream_ids)
+
+    def __len__(self):
+        return len(self.dates)
+
+    def translate(self, id_map):
+        # Copy with stream IDs replaced according to id_map (old ID -> new ID), others kept.
+        unique_ids, inverse = np.unique(self.stream_ids, return_inverse=True)
+        translated = np.array(
+            [id_map.get(int(stream_id), stream_id) for stream_id in unique_ids],
+            dtype=np.int64,
+        )
+        return CalendarArray(self.dates, translated[inverse])
+
+    def weekdays(self):
+        # Weekday number per date, Monday is 0 and Sunday is 6.
+        return (self.dates.astype(np.int64) + EPOCH_WEEKDAY) % 7
+
+    def weekday_mask(self, weekdays):
+        # Boolean mask of the dates on one of the weekday names (case insensitive, unknown names ignored).
+        numbers = [
+            WEEKDAYS.index(weekday.capitalize())
+            for weekday in weekdays
+            if weekday.capitalize() in WEEKDAYS
+        ]
+        return np.isin(self.weekdays(), numbers)
+
+    def stream_mask(self, stream_ids):
+        # One comparison per stream ID: for the few streams of a post code this is several
+        # times faster than np.isin, which sorts its inputs.
+        mask = np.zeros(len(self.stream_ids), dtype=bool)
+        for stream_id in set(stream_ids):
+            mask |= self.stream_ids == stream_id
+        return mask
+
+    def filter(self, mask):
+        return CalendarArray(self.dates[mask], self.stream_ids[mask])
+
+    def filter_weekdays(self, weekdays):
+        return self.filter(self.weekday_mask(weekdays))
+
+    def date_strings(self):
+        return np.datetime_as_string(self.dates, unit="D")
+
+    def weekday_names(self):
+        return np.array(WEEKDAYS)[self.weekdays()]
@@ -0,0 +1,239 @@
+import argparse
+import json
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from integration_API import HagueAPI, create_session
+
+# Fields kept per document, everything else from the Huisvuilkalendar API is dropped.
+ADDRESS_FIELDS = ("bagid", "postcode", "huisnummer", "huisletter")
+WASTE_STREAM_FIELDS = ("id", "title")
+CALENDAR_FIELDS = ("afvalstroom_id", "ophaaldatum")
+
+
+class NotInStoreError(LookupError):
+    pass
+
+
+def pick(item, fields):
+    return {field: item[field] for field in fields if field in item}
+
+
+def compact(value):
+    return json.dumps(value, separators=(",", ":"))
+
+
+class CalendarStore:
+    # Local SQLite copy of the Huisvuilkalendar data: addresses indexed by
+    # (postcode, house number, house letter) -> bag ID, and 'afvalstromen' and
+    # calendars per bag ID. Filled by import_calendars, read by OfflineHagueAPI.
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS addresses ("
+            "postcode TEXT, housenumber TEXT, houseletter TEXT, bagid TEXT, body TEXT, "
+            "PRIMARY KEY (postcode, housenumber, houseletter)) WITHOUT ROWID;"
+            "CREATE TABLE IF NOT EXISTS waste_streams ("
+            "bagid TEXT PRIMARY KEY, body TEXT) WITHOUT ROWID;"
+            "CREATE TABLE IF NOT EXISTS calendars ("
+            "bagid TEXT, year INTEGER, body TEXT, "
+            "PRIMARY KEY (bagid, year)) WITHOUT ROWID;"
+        )
+
+    def put_addresses(self, post_code, house_number, addresses):
+        rows = [
+            (
+                post_code,
+                str(house_number),
+                address["huisletter"],
+                address["bagid"],
+                compact(pick(address, ADDRESS_FIELDS)),
+            )
+            for address in addresses
+        ]
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO addresses VALUES (?, ?, ?, ?, ?)", rows
+            )
+
+    def put_waste_streams(self, bag_id, waste_streams):
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO waste_streams VALUES (?, ?)",
+                (
+                    bag_id,
+                    compact(
+                        [pick(item, WASTE_STREAM_FIELDS) for item in waste_streams]
+                    ),
+                ),
+            )
+
+    def put_calendar(self, bag_id, year, hague_dates):
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO calendars VALUES (?, ?, ?)",
+                (
+                    bag_id,
+                    year,
+                    compact([pick(item, CALENDAR_FIELDS) for item in hague_dates]),
+                ),
+            )
+
+    def _fetch(self, query, args):
+        with self._lock:
+            return self._db.execute(query, args).fetchall()
+
+    def get_addresses(self, post_code, house_number):
+        rows = self._fetch(
+            "SELECT body FROM addresses WHERE postcode = ? AND housenumber = ?",
+            (post_code, str(house_number)),
+        )
+        return [json.loads(body) for body, in rows]
+
+    def get_bagid(self, post_code, house_number, house_letter):
+        rows = self._fetch(
+            "SELECT bagid FROM addresses "
+            "WHERE postcode = ? AND housenumber = ? AND houseletter = ?",
+            (post_code, str(house_number), house_letter),
+        )
+        return rows[0][0] if rows else None
+
+    def get_waste_streams(self, bag_id, loads=json.loads):
+        # loads parses the stored JSON, e.g. ContentStore.load to share identical documents.
+        rows = self._fetch("SELECT body FROM waste_streams WHERE bagid = ?", (bag_id,))
+        if not rows:
+            raise NotInStoreError(f"No 'afvalstromen' stored for bag ID {bag_id}")
+        return loads(rows[0][0])
+
+    def get_calendar(self, bag_id, year, loads=json.loads):
+        rows = self._fetch(
+            "SELECT body FROM calendars WHERE bagid = ? AND year = ?", (bag_id, year)
+        )
+        if not rows:
+            raise NotInStoreError(f"No {year} calendar stored for bag ID {bag_id}")
+        return loads(rows[0][0])
+
+    def get_years(self, bag_id):
+        # Years with a stored calendar for the bag ID.
+        rows = self._fetch("SELECT year FROM calendars WHERE bagid = ?", (bag_id,))
+        return {year for year, in rows}
+
+    def close(self):
+        self._db.close()
+
+
+class OfflineHagueAPI(HagueAPI):
+    # HagueAPI answering entirely from a CalendarStore, without any request upstream.
+
+    def __init__(self, store):
+        super().__init__()
+        self.store = store
+
+    def get_waste_streams(self, bag_id):
+        return self.store.get_waste_streams(bag_id, self.documents.load)
+
+    def get_dates_per_stream(self, bag_id, year=None):
+        year = year if year is not None else date.today().year
+        return self.store.get_calendar(bag_id, year, self.documents.load)
+
+    def iter_dates_per_stream(
+        self, bag_id, fields=("afvalstroom_id", "ophaaldatum"), year=None
+    ):
+        # The stored calendar entries with only the given fields, like the streamed API ones.
+        year = year if year is not None else date.today().year
+        for item in self.store.get_calendar(bag_id, year):
+            yield pick(item, fields)
+
+    def calendar_years(self, bag_id, start, end):
+        # Only the stored years of the range: a window crossing into a year that was not
+        # imported (e.g. the coming weeks in December) has no entries there. Raises
+        # NotInStoreError if none of them is stored.
+        stored = self.store.get_years(bag_id)
+        years = [year for year in range(start.year, end.year + 1) if year in stored]
+        if not years:
+            raise NotInStoreError(
+                f"No {start.year} calendar stored for bag ID {bag_id}"
+            )
+        return years
+
+    def get_addresses(self, post_code, house_number):
+        return self.store.get_addresses(post_code, house_number)
+
+
+def import_entry(hague_api, entry, years):
+    # Fetch all documents for one "POSTCODE:HOUSENUMBER" address or bag ID.
+    addresses = None
+    if ":" in entry:
+        post_code, house_number = entry.split(":", 1)
+        addresses = hague_api.get_addresses(post_code, house_number)
+        bag_ids = [address["bagid"] for address in addresses]
+    else:
+        bag_ids = [entry]
+    documents = [
+        (
+            bag_id,
+            hague_api.get_waste_streams(bag_id),
+            {year: hague_api.get_dates_per_stream(bag_id, year) for year in years},
+        )
+        for bag_id in bag_ids
+    ]
+    return entry, addresses, documents
+
+
+def import_calendars(hague_api, store, entries, workers=8, years=None):
+    # Bulk import addresses ("POSTCODE:HOUSENUMBER") or bag IDs into the store, with the
+    # calendars of the given years (the current year by default).
+    years = years if years is not None else [date.today().year]
+    count = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for entry, addresses, documents in executor.map(
+            lambda entry: import_entry(hague_api, entry, years), entries
+        ):
+            if addresses is not None:
+                post_code, house_number = entry.split(":", 1)
+                store.put_addresses(post_code, house_number, addresses)
+            for bag_id, waste_streams, calendars in documents:
+                store.put_waste_streams(bag_id, waste_streams)
+                for year, hague_dates in calendars.items():
+                    store.put_calendar(bag_id, year, hague_dates)
+            count += 1
+    return count
+
+
+def read_entries(path):
+    with open(path) as entries_file:
+        return [line.strip() for line in entries_file if line.strip()]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-d", "--database", help="SQLite file of the calendar store", required=True
+    )
+    parser.add_argument(
+        "-i",
+        "--input",
+        help="File with one POSTCODE:HOUSENUMBER or bag ID per line",
+        required=True,
+    )
+    parser.add_argument(
+        "-w", "--workers", type=int, default=8, help="Number of concurrent requests"
+    )
+    parser.add_argument(
+        "-y",
+        "--years",
+        type=int,
+        nargs="+",
+        help="Calendar years to import (default: the current year)",
+    )
+    args = parser.parse_args()
+
+    store = CalendarStore(args.database)
+    hague_api = HagueAPI(create_session(args.workers))
+    count = import_calendars(
+        hague_api, store, read_entries(args.input), args.workers, args.years
+    )
+    print(f"Imported {count} entries into {args.database}")
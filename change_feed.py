@@ -0,0 +1,210 @@
+import argparse
+import json
+import sqlite3
+import sys
+import threading
+from datetime import date
+from integration_API import SeenonsAPI, create_session, upcoming_window
+from resolver import AddressResolver
+from response_cache import ResponseCache
+from batch import read_addresses, resolve_batch, DEFAULT_WORKERS
+from calendar_store import compact
+from transport import Transport
+from municipalities import create_router
+
+# Weeks ahead whose collection dates are watched for changes.
+DEFAULT_WEEKS = 8
+# A removed and an added date of a stream at most this many days apart count as a move.
+MAX_MOVE_DAYS = 7
+
+
+class SnapshotStore:
+    # SQLite file with the last seen collection dates per stream for every bag ID, and the
+    # window (start and end date) they were fetched for.
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS snapshots ("
+            "bagid TEXT PRIMARY KEY, start TEXT, end TEXT, body TEXT) WITHOUT ROWID"
+        )
+
+    def get(self, bag_id):
+        # (start, end, dates per stream ID) of the last snapshot, None if there is none.
+        with self._lock:
+            row = self._db.execute(
+                "SELECT start, end, body FROM snapshots WHERE bagid = ?", (bag_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        start, end, body = row
+        streams = {
+            int(stream_id): dates for stream_id, dates in json.loads(body).items()
+        }
+        return start, end, streams
+
+    def put(self, bag_id, start, end, streams):
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?, ?)",
+                (bag_id, start, end, compact(streams)),
+            )
+
+    def close(self):
+        self._db.close()
+
+
+def days_apart(first, second):
+    return abs((date.fromisoformat(first) - date.fromisoformat(second)).days)
+
+
+def diff_dates(old, new, max_move_days=MAX_MOVE_DAYS):
+    # Added, removed and moved ({"from", "to"}) dates between two lists of ISO dates.
+    # Each removed date is paired, in date order, with the nearest added date that is
+    # at most max_move_days away.
+    removed = sorted(set(old) - set(new))
+    added = sorted(set(new) - set(old))
+    moved = []
+    for day in list(removed):
+        nearby = [other for other in added if days_apart(day, other) <= max_move_days]
+        if nearby:
+            target = min(nearby, key=lambda other: days_apart(day, other))
+            moved.append({"from": day, "to": target})
+            removed.remove(day)
+            added.remove(target)
+    return added, removed, moved
+
+
+def diff_streams(old, new, stream_types=None):
+    # Changes per stream ID between two dicts of dates per stream ID, for changed streams only.
+    stream_types = stream_types or {}
+    changes = []
+    for stream_id in dict.fromkeys([*new, *old]):
+        added, removed, moved = diff_dates(
+            old.get(stream_id, []), new.get(stream_id, [])
+        )
+        if added or removed or moved:
+            changes.append(
+                {
+                    "id": stream_id,
+                    "type": stream_types.get(stream_id),
+                    "added": added,
+                    "removed": removed,
+                    "moved": moved,
+                }
+            )
+    return changes
+
+
+def clip(streams, first, last):
+    # Only the dates from first up to and including last (ISO date strings).
+    return {
+        stream_id: [day for day in dates if first <= day <= last]
+        for stream_id, dates in streams.items()
+    }
+
+
+def address_changes(snapshots, record, start, end):
+    # Update the snapshot of a resolved address. Returns its changed streams compared to the
+    # previous snapshot, within the dates both cover from start on; None for a new address.
+    streams = {stream["id"]: stream["dates"] for stream in record["streams"]}
+    previous = snapshots.get(record["bagid"])
+    snapshots.put(record["bagid"], start, end, streams)
+    if previous is None:
+        return None
+    _, previous_end, previous_streams = previous
+    last = min(end, previous_end)
+    return diff_streams(
+        clip(previous_streams, start, last),
+        clip(streams, start, last),
+        {stream["id"]: stream["type"] for stream in record["streams"]},
+    )
+
+
+def iter_changes(
+    resolver,
+    snapshots,
+    addresses,
+    weeks=DEFAULT_WEEKS,
+    workers=DEFAULT_WORKERS,
+    today=None,
+):
+    # Delta records (address, bag ID and changed streams) of the addresses whose collection
+    # dates in the coming weeks changed since the last run. Addresses seen for the first time
+    # and addresses that cannot be resolved are stored or skipped without a delta.
+    start, end = upcoming_window(weeks, today)
+    records = resolve_batch(resolver, addresses, workers=workers, start=start, end=end)
+    for record in records:
+        if "error" in record:
+            continue
+        changes = address_changes(snapshots, record, start.isoformat(), end.isoformat())
+        if changes:
+            yield {
+                "postcode": record["postcode"],
+                "housenumber": record["housenumber"],
+                "houseletter": record["houseletter"],
+                "bagid": record["bagid"],
+                "streams": changes,
+            }
+
+
+def main(
+    input_path,
+    snapshot_path,
+    output_path=None,
+    weeks=DEFAULT_WEEKS,
+    workers=DEFAULT_WORKERS,
+    cache_path=None,
+):
+    session = Transport(create_session(workers))
+    cache = ResponseCache(cache_path) if cache_path else None
+    resolver = AddressResolver(
+        SeenonsAPI(session, cache=cache), create_router(None, session, cache)
+    )
+    snapshots = SnapshotStore(snapshot_path)
+    output = open(output_path, "w") if output_path else sys.stdout
+    try:
+        for delta in iter_changes(
+            resolver, snapshots, read_addresses(input_path), weeks, workers
+        ):
+            output.write(json.dumps(delta) + "\n")
+    finally:
+        snapshots.close()
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-i", "--input", help="CSV or JSONL file with addresses", required=True
+    )
+    parser.add_argument(
+        "-d",
+        "--database",
+        help="SQLite file with the snapshots of the previous run",
+        required=True,
+    )
+    parser.add_argument(
+        "-o", "--output", help="JSONL file for the deltas (default stdout)"
+    )
+    parser.add_argument(
+        "--weeks",
+        type=int,
+        default=DEFAULT_WEEKS,
+        help="Weeks ahead to watch for changed collection dates",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help="Number of concurrent lookups",
+    )
+    parser.add_argument("-c", "--cache", help="SQLite file to cache API responses in")
+    args = parser.parse_args()
+
+    main(args.input, args.database, args.output, args.weeks, args.workers, args.cache)
@@ -0,0 +1,89 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+# Parsed documents a ContentStore keeps, and results an LRUCache keeps by default.
+DEFAULT_MAX_DOCUMENTS = 512
+DEFAULT_MAX_RESULTS = 10000
+
+
+def content_digest(body):
+    # SHA-1 of a response body (text or bytes), identifying its content.
+    if isinstance(body, str):
+        body = body.encode()
+    return hashlib.sha1(body).hexdigest()
+
+
+class LRUCache:
+    # Thread-safe results of compute() per key, kept for the max_size most recently used keys.
+    # Concurrent callers of a key that is being computed wait for that result.
+
+    def __init__(self, max_size=DEFAULT_MAX_RESULTS):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._values = OrderedDict()
+
+    def get(self, key, compute):
+        # Cached value of the key, or the one returned by compute() (then cached).
+        with self._lock:
+            future = self._values.get(key)
+            owner = future is None
+            if owner:
+                future = self._values[key] = Future()
+                while len(self._values) > self.max_size:
+                    self._values.popitem(last=False)
+            else:
+                self._values.move_to_end(key)
+        if owner:
+            try:
+                future.set_result(compute())
+            except Exception as error:
+                # Failed computations are not cached.
+                with self._lock:
+                    if self._values.get(key) is future:
+                        del self._values[key]
+                future.set_exception(error)
+        return future.result()
+
+    def __len__(self):
+        return len(self._values)
+
+
+class ContentStore:
+    # Parsed JSON documents by the digest of their body. Identical responses (e.g. the same
+    # calendar for all addresses in a street) are parsed once and shared as one object, and
+    # digest(document) gives the content key to compute results once per distinct document.
+
+    def __init__(self, max_documents=DEFAULT_MAX_DOCUMENTS):
+        self.max_documents = max_documents
+        self._lock = threading.Lock()
+        self._documents = OrderedDict()
+        self._digests = {}
+
+    def load(self, body):
+        # The parsed document of a JSON body, shared with earlier identical bodies.
+        digest = content_digest(body)
+        with self._lock:
+            if digest in self._documents:
+                self._documents.move_to_end(digest)
+                return self._documents[digest]
+        document = json.loads(body)
+        with self._lock:
+            if digest in self._documents:
+                return self._documents[digest]
+            self._documents[digest] = document
+            self._digests[id(document)] = digest
+            while len(self._documents) > self.max_documents:
+                _, evicted = self._documents.popitem(last=False)
+                del self._digests[id(evicted)]
+        return document
+
+    def digest(self, document):
+        # Digest of a document returned by load while it is stored, None for other objects.
+        with self._lock:
+            return self._digests.get(id(document))
+
+    def __len__(self):
+        return len(self._documents)
@@ -0,0 +1,208 @@
+import logging
+import threading
+import time
+from contextlib import nullcontext
+
+# Upper bounds in seconds of the latency histogram buckets.
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_NULL_STAGE = nullcontext()
+
+
+class Sink:
+    # Receives the recorded events. Subclasses override the events they are interested in.
+
+    def record_upstream_call(self, endpoint, seconds, size, status):
+        pass
+
+    def record_cache(self, endpoint, hit):
+        pass
+
+    def record_retry(self, endpoint):
+        pass
+
+    def record_stage(self, stage, seconds):
+        pass
+
+
+class Instrumentation:
+    # Records upstream API calls and integration stages and forwards them to the sinks.
+    # Without sinks every hook returns immediately, so disabled instrumentation costs next to nothing.
+
+    def __init__(self, sinks=()):
+        self.sinks = list(sinks)
+
+    @property
+    def enabled(self):
+        return bool(self.sinks)
+
+    def upstream_call(self, endpoint, seconds, size, status):
+        for sink in self.sinks:
+            sink.record_upstream_call(endpoint, seconds, size, status)
+
+    def cache(self, endpoint, hit):
+        for sink in self.sinks:
+            sink.record_cache(endpoint, hit)
+
+    def retry(self, endpoint):
+        for sink in self.sinks:
+            sink.record_retry(endpoint)
+
+    def stage(self, stage):
+        # Context manager timing an integration stage.
+        if not self.sinks:
+            return _NULL_STAGE
+        return _StageTimer(self, stage)
+
+
+class _StageTimer:
+    __slots__ = ("instrumentation", "stage", "started")
+
+    def __init__(self, instrumentation, stage):
+        self.instrumentation = instrumentation
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self.started
+        for sink in self.instrumentation.sinks:
+            sink.record_stage(self.stage, seconds)
+
+
+NULL_INSTRUMENTATION = Instrumentation()
+
+
+class LoggingSink(Sink):
+    # Writes one log line per event.
+
+    def __init__(self, logger=None, level=logging.INFO):
+        self.logger = logger if logger is not None else logging.getLogger("integration")
+        self.level = level
+
+    def record_upstream_call(self, endpoint, seconds, size, status):
+        self.logger.log(
+            self.level,
+            "upstream %s status=%s bytes=%d ms=%.1f",
+            endpoint,
+            status,
+            size,
+            seconds * 1000,
+        )
+
+    def record_cache(self, endpoint, hit):
+        self.logger.log(self.level, "cache %s %s", endpoint, "hit" if hit else "miss")
+
+    def record_retry(self, endpoint):
+        self.logger.log(self.level, "retry %s", endpoint)
+
+    def record_stage(self, stage, seconds):
+        self.logger.log(self.level, "stage %s ms=%.3f", stage, seconds * 1000)
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+class MetricsSink(Sink):
+    # Prometheus style counters and histograms kept in memory; render() gives the text exposition format.
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def increment(self, name, labels, amount=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram(self.buckets)
+            self.histograms[key].observe(value)
+
+    def record_upstream_call(self, endpoint, seconds, size, status):
+        self.increment(
+            "upstream_requests_total", {"endpoint": endpoint, "status": str(status)}
+        )
+        self.increment("upstream_response_bytes_total", {"endpoint": endpoint}, size)
+        self.observe("upstream_request_seconds", {"endpoint": endpoint}, seconds)
+
+    def record_cache(self, endpoint, hit):
+        result = "hit" if hit else "miss"
+        self.increment("cache_requests_total", {"endpoint": endpoint, "result": result})
+
+    def record_retry(self, endpoint):
+        self.increment("upstream_retries_total", {"endpoint": endpoint})
+
+    def record_stage(self, stage, seconds):
+        self.observe("stage_seconds", {"stage": stage}, seconds)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                lines.append(f"{name}{format_labels(labels)} {value}")
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    bucket_labels = labels + (("le", str(bound)),)
+                    lines.append(f"{name}_bucket{format_labels(bucket_labels)} {count}")
+                inf_labels = labels + (("le", "+Inf"),)
+                lines.append(
+                    f"{name}_bucket{format_labels(inf_labels)} {histogram.count}"
+                )
+                lines.append(f"{name}_sum{format_labels(labels)} {histogram.sum}")
+                lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+class SpanSink(Sink):
+    # Reports upstream calls and stages as spans to an OpenTelemetry compatible tracer
+    # (anything with start_span(name, attributes=..., start_time=...) returning spans with end()).
+
+    def __init__(self, tracer):
+        self.tracer = tracer
+
+    def _span(self, name, seconds, attributes):
+        end = time.time_ns()
+        span = self.tracer.start_span(
+            name, attributes=attributes, start_time=end - int(seconds * 1e9)
+        )
+        span.end(end_time=end)
+
+    def record_upstream_call(self, endpoint, seconds, size, status):
+        self._span(
+            f"upstream {endpoint}",
+            seconds,
+            {
+                "http.status_code": status,
+                "http.response_content_length": size,
+                "endpoint": endpoint,
+            },
+        )
+
+    def record_stage(self, stage, seconds):
+        self._span(f"stage {stage}", seconds, {"stage": stage})
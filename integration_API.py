@@ -1,26 +1,161 @@
-from datetime import datetime, date
+from datetime import date, timedelta
 import requests
-import sys
-import copy
+from requests.adapters import HTTPAdapter
+import time
+from stream_mapping import StreamMapping
+from calendar_array import CalendarArray, WEEKDAYS
+from availability_index import AvailabilityIndex
+from schedule import summarise_index
+from single_flight import SingleFlight
+from instrumentation import NULL_INSTRUMENTATION
+from json_stream import iter_items
+from transport import Transport
+from content_store import ContentStore
+from models import Address, HagueStream, CollectionDate, from_payloads
 
 
 SEENONS_BASE = "https://api-dev-593.seenons.com/api/me/streams"
 HUISVUILKALENDAR = "https://huisvuilkalender.denhaag.nl"
-YEAR = date.today().year
+# Bytes read at a time when parsing streamed responses.
+STREAM_CHUNK_SIZE = 64 * 1024
 
 
-class SeenonsAPI:
+class AddressNotFoundError(LookupError):
+    # The post code and house number do not form a known address.
+    pass
+
+
+def upcoming_window(weeks, today=None):
+    # (start, end) dates of the coming number of weeks, starting today.
+    start = today if today is not None else date.today()
+    return start, start + timedelta(weeks=weeks)
+
+
+def in_date_range(hague_dates, start, end):
+    # Calendar entries with a pickup date from start up to and including end.
+    first, last = start.isoformat(), end.isoformat()
+    for hague_date in hague_dates:
+        if first <= hague_date["ophaaldatum"] <= last:
+            yield hague_date
+
+
+def create_session(pool_size=10):
+    # Pooled keep-alive session with pool_size connections per host, to share between threads.
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class APIClient:
+    def __init__(self, base_url, session=None, cache=None, instrumentation=None):
+        # Transport sending the requests with timeouts, retries, rate limiting and a circuit
+        # breaker (see transport.py). A plain HTTP session (e.g. a pooled requests.Session,
+        # plain requests by default) gets a Transport of its own, share one to share its limits.
+        self.transport = (
+            session if isinstance(session, Transport) else Transport(session)
+        )
+        self.base_url = base_url
+        # Optional ResponseCache (see response_cache.py) shared between API objects.
+        self.cache = cache
+        # Concurrent requests for the same URL share one upstream call (see single_flight.py).
+        self.single_flight = SingleFlight()
+        # Identical responses are parsed once and shared (see content_store.py).
+        self.documents = ContentStore()
+        # Records latency, size and cache use per endpoint (see instrumentation.py).
+        self.instrumentation = (
+            instrumentation if instrumentation is not None else NULL_INSTRUMENTATION
+        )
+
+    def get_json(self, url, endpoint):
+        # Get the JSON document at url. Results may be shared between threads, do not mutate them.
+        return self.single_flight.do(url, self._get_json, url, endpoint)
+
+    def _get_json(self, url, endpoint):
+        # Get the JSON document at url, served from the cache while it is fresh.
+        if self.cache is None:
+            return self.documents.load(self.request(url, endpoint).content)
+        entry = self.cache.get(url)
+        fresh = entry is not None and entry.is_fresh()
+        self.instrumentation.cache(endpoint, fresh)
+        if fresh:
+            return self.documents.load(entry.body)
+        # Expired entries are revalidated with their ETag / Last-Modified.
+        headers = entry.validators() if entry is not None else {}
+        try:
+            response = self.request(url, endpoint, headers)
+        except requests.RequestException:
+            # While the upstream is down (or its circuit is open) an expired copy beats none.
+            if entry is None:
+                raise
+            return self.documents.load(entry.body)
+        if response.status_code == 304 and entry is not None:
+            self.cache.touch(url, endpoint)
+            return self.documents.load(entry.body)
+        if response.status_code == 200:
+            self.cache.put(
+                url,
+                response.text,
+                endpoint,
+                response.headers.get("ETag"),
+                response.headers.get("Last-Modified"),
+            )
+        return self.documents.load(response.content)
+
+    def request(self, url, endpoint, headers=None):
+        # Send the GET request upstream, recording its latency and response size.
+        if not self.instrumentation.enabled:
+            return self.transport.get(url, headers)
+        started = time.perf_counter()
+        response = self.transport.get(url, headers, on_retry=self._on_retry(endpoint))
+        self.instrumentation.upstream_call(
+            endpoint,
+            time.perf_counter() - started,
+            len(response.content),
+            response.status_code,
+        )
+        return response
+
+    def _on_retry(self, endpoint):
+        return lambda: self.instrumentation.retry(endpoint)
+
+    def stream_items(self, url, endpoint, key=None, fields=None):
+        # Yield the array elements of the JSON document at url while it downloads, keeping only
+        # the given fields (see json_stream.py). Streamed responses bypass the cache.
+        started = time.perf_counter()
+        on_retry = self._on_retry(endpoint) if self.instrumentation.enabled else None
+        with self.transport.get(url, stream=True, on_retry=on_retry) as response:
+            response.raise_for_status()
+            yield from iter_items(response.iter_content(STREAM_CHUNK_SIZE), key, fields)
+            if self.instrumentation.enabled:
+                self.instrumentation.upstream_call(
+                    endpoint,
+                    time.perf_counter() - started,
+                    response.raw.tell(),
+                    response.status_code,
+                )
+
+
+class SeenonsAPI(APIClient):
+    def __init__(
+        self, session=None, base_url=SEENONS_BASE, cache=None, instrumentation=None
+    ):
+        super().__init__(base_url, session, cache, instrumentation)
+
     def get_all_waste_streams(self):
         # Get all waste streams from Seenons API.
-        url = SEENONS_BASE
-        response = requests.get(url)
-        return response.json()
+        url = self.base_url
+        return self.get_json(url, "seenons_streams")
+
+    def iter_all_waste_streams(self, fields=("stream_product_id", "type")):
+        # Stream the Seenons catalogue items one by one, with only the given fields.
+        return self.stream_items(self.base_url, "seenons_streams", "items", fields)
 
     def get_waste_streams_per_postcode(self, post_code):
         # Get waste streams for given post code using the Seenons API.
-        url = f"{SEENONS_BASE}?postal_code={post_code}"
-        response = requests.get(url)
-        return response.json()
+        url = f"{self.base_url}?postal_code={post_code}"
+        return self.get_json(url, "seenons_postcode_streams")
 
     def get_list_of_stream_ids(self, streams):
         # Make list of available stream IDs.
@@ -30,96 +165,222 @@ class SeenonsAPI:
         return stream_ids
 
 
-class HagueAPI:
+class HagueAPI(APIClient):
+    def __init__(
+        self, session=None, base_url=HUISVUILKALENDAR, cache=None, instrumentation=None
+    ):
+        super().__init__(base_url, session, cache, instrumentation)
+
     def get_waste_streams(self, bag_id):
         # Get 'afvalstromen' from the Huisvuilkalendar API.
-        url = f"{HUISVUILKALENDAR}/rest/adressen/{bag_id}/afvalstromen"
-        response = requests.get(url)
-        return response.json()
+        url = f"{self.base_url}/rest/adressen/{bag_id}/afvalstromen"
+        return self.get_json(url, "hague_afvalstromen")
+
+    def calendar_url(self, bag_id, year):
+        return f"{self.base_url}/rest/adressen/{bag_id}/kalender/{year}"
 
-    def get_dates_per_stream(self, bag_id):
+    def calendar_endpoint(self, year):
+        # Each year is cached separately: past calendars no longer change, while the current
+        # year gets a short TTL so moved pickups show up (revalidated with its ETag).
+        current_year = date.today().year
+        if year < current_year:
+            return "hague_kalender_past"
+        if year > current_year:
+            return "hague_kalender_next"
+        return "hague_kalender"
+
+    def get_dates_per_stream(self, bag_id, year=None):
         # Get dates and waste streams IDs from the Huisvuilkalendar API using bag ID.
-        url = f"{HUISVUILKALENDAR}/rest/adressen/{bag_id}/kalender/{YEAR}"
-        response = requests.get(url)
-        return response.json()
+        # The year is that of today by default, so long-running processes cross New Year.
+        year = year if year is not None else date.today().year
+        return self.get_json(
+            self.calendar_url(bag_id, year), self.calendar_endpoint(year)
+        )
+
+    def iter_dates_per_stream(
+        self, bag_id, fields=("afvalstroom_id", "ophaaldatum"), year=None
+    ):
+        # Stream the calendar entries for the bag ID one by one, with only the given fields.
+        year = year if year is not None else date.today().year
+        return self.stream_items(
+            self.calendar_url(bag_id, year), self.calendar_endpoint(year), fields=fields
+        )
+
+    def calendar_years(self, bag_id, start, end):
+        # Years of the calendars covering start up to and including end (dates).
+        return range(start.year, end.year + 1)
+
+    def get_dates_in_range(self, bag_id, start, end):
+        # Calendar entries from start up to and including end (dates), fetching only the
+        # calendars of the years in between.
+        hague_dates = []
+        for year in self.calendar_years(bag_id, start, end):
+            hague_dates.extend(
+                in_date_range(self.get_dates_per_stream(bag_id, year), start, end)
+            )
+        return hague_dates
+
+    def iter_dates_in_range(
+        self, bag_id, start, end, fields=("afvalstroom_id", "ophaaldatum")
+    ):
+        # Streaming version of get_dates_in_range.
+        for year in self.calendar_years(bag_id, start, end):
+            yield from in_date_range(
+                self.iter_dates_per_stream(bag_id, fields, year), start, end
+            )
+
+    def get_addresses(self, post_code, house_number):
+        # Get all addresses (one per house letter) for the post code and house number, empty list if none.
+        url = f"{self.base_url}/adressen/{post_code}:{house_number}"
+        return self.get_json(url, "hague_adressen")
 
     def get_house_info(self, post_code, house_number):
         # Display options for available house letters given the post code and house number.
-        url = f"{HUISVUILKALENDAR}/adressen/{post_code}:{house_number}"
-        response = requests.get(url).json()
+        response = self.get_addresses(post_code, house_number)
         if response != []:
             return response
-        # If post code / house number is wrong, we get an empty list for house info and need to exit.
+        # If post code / house number is wrong, we get an empty list for house info.
         else:
-            print("Postal address does not exist")
-            sys.exit()
+            raise AddressNotFoundError(
+                f"Postal address {post_code} {house_number} does not exist"
+            )
 
     def get_bagid(self, addresses, house_letter):
-        # Get bag ID from the address details
-        for address in addresses:
-            if address["huisletter"] == house_letter:
-                return address["bagid"]
+        # Get bag ID from the address details (payloads or Address models)
+        for address in from_payloads(Address, addresses):
+            if address.house_letter == house_letter:
+                return address.bag_id
 
 
 class Integration:
+    def __init__(self, instrumentation=None):
+        # Records the duration of each integration stage (see instrumentation.py).
+        self.instrumentation = (
+            instrumentation if instrumentation is not None else NULL_INSTRUMENTATION
+        )
+
     def translate_date_to_weekday(self, calendar_date):
-        # Translate calendar date format to weekday (Monday, Tuesday etc).
-        datetime_object = datetime.strptime(calendar_date, "%Y-%m-%d")
-        return datetime_object.strftime("%A")
+        # Translate calendar date format to weekday (Monday, Tuesday etc). fromisoformat is
+        # much faster than strptime, and the names do not depend on the locale.
+        return WEEKDAYS[date.fromisoformat(calendar_date).weekday()]
+
+    def get_stream_mapping(self, all_seenons_waste_streams):
+        # Translation index for the Seenons catalogue; a prebuilt StreamMapping is used as is.
+        if isinstance(all_seenons_waste_streams, StreamMapping):
+            return all_seenons_waste_streams
+        return StreamMapping.from_seenons_streams(all_seenons_waste_streams)
 
     def translate_hague_to_seenons_id(
         self, all_seenons_waste_streams, hague_available_streams
     ):
-        # Change the IDs in the Hague available streams to match those of Seenons API.
-        # All IDs are considered (0) until we find a match to the Seenons API.
-        for hague_stream in hague_available_streams:
-            hague_stream["id"] = 0
-            for seenons_stream in all_seenons_waste_streams["items"]:
-                # If the stream product ID starts with the title in the Hague stream ID, then overwrite the Hague stream ID.
-                if (
-                    seenons_stream["type"]
-                    .lower()
-                    .startswith(hague_stream["title"].lower())
-                ):
-                    hague_stream["id"] = seenons_stream["stream_product_id"]
-        # Keep in mind that returned list is mutated
-        return hague_available_streams
+        # HagueStreams of the Hague available streams with the IDs of the Seenons API.
+        # Streams without a match in the Seenons API get ID 0.
+        stream_mapping = self.get_stream_mapping(all_seenons_waste_streams)
+        return [
+            hague_stream._replace(id=stream_mapping.translate(hague_stream.title))
+            for hague_stream in from_payloads(HagueStream, hague_available_streams)
+        ]
 
     def modify_hague_stream_dates(
         self, hague_waste_streams, all_seenons_waste_streams, hague_dates
     ):
-        # Need to map 'afvalstrrom_id' value in Hague dates list to that of Seenons API.
-        # First we make a deep copy of the Hague waste streams date as the list will be mutated in the next modification step
-        old_hague_waste_streams = copy.deepcopy(hague_waste_streams)
-        # Now we modify Hague waste stream IDs with the Seenons IDs.
-        hague_waste_streams = self.translate_hague_to_seenons_id(
-            all_seenons_waste_streams, hague_waste_streams
-        )
-        # Create dict to map old to new waste stream IDs. Key is old ID, value is new.
-        mapping_dict = {}
-        for index, item in enumerate(old_hague_waste_streams):
-            mapping_dict[item["id"]] = hague_waste_streams[index]["id"]
-        # Modify dates according to mapping dict
-        for item in hague_dates:
-            if item["afvalstroom_id"] in mapping_dict:
-                item["afvalstroom_id"] = mapping_dict[item["afvalstroom_id"]]
-        return hague_dates
+        # Need to map 'afvalstroom_id' value in Hague dates list to that of Seenons API.
+        # all_seenons_waste_streams is the Seenons catalogue or a StreamMapping built from it.
+        # Map old to new waste stream IDs. Key is old ID, value is new.
+        with self.instrumentation.stage("modify_hague_stream_dates"):
+            mapping_dict = self.get_stream_mapping(all_seenons_waste_streams).id_map(
+                hague_waste_streams
+            )
+            # CollectionDates with the stream IDs according to mapping dict.
+            return [
+                item._replace(
+                    stream_id=mapping_dict.get(item.stream_id, item.stream_id)
+                )
+                for item in from_payloads(CollectionDate, hague_dates)
+            ]
 
     def add_weekday_to_hague_dates(self, hague_dates):
-        # Add weekday info to the Hague dates list
-        for item in hague_dates:
-            item["weekday"] = self.translate_date_to_weekday(item["ophaaldatum"])
-        return hague_dates
+        # CollectionDates of the Hague dates list with their weekday set.
+        with self.instrumentation.stage("add_weekday_to_hague_dates"):
+            return [
+                item._replace(weekday=self.translate_date_to_weekday(item.date))
+                for item in from_payloads(CollectionDate, hague_dates)
+            ]
+
+    def create_calendar_array(
+        self, hague_waste_streams, all_seenons_waste_streams, hague_dates
+    ):
+        # Array backed alternative to modify_hague_stream_dates for large calendars (see calendar_array.py).
+        with self.instrumentation.stage("create_calendar_array"):
+            mapping_dict = self.get_stream_mapping(all_seenons_waste_streams).id_map(
+                hague_waste_streams
+            )
+            return CalendarArray.from_hague_dates(hague_dates).translate(mapping_dict)
 
     def create_availability_dict(self, hague_dates, seenons_stream_ids):
         # Create a dict with matching stream ID as keys and all available dates per stream as values.
+        # hague_dates is a list of Hague date dicts or CollectionDates, or a CalendarArray.
+        with self.instrumentation.stage("create_availability_dict"):
+            if isinstance(hague_dates, CalendarArray):
+                return self._create_availability_dict_from_array(
+                    hague_dates, seenons_stream_ids
+                )
+            stream_dict = {}
+            for item in from_payloads(CollectionDate, hague_dates):
+                # If stream ID of (filtered) dates is in the Seenons API list,
+                # add the date to the dates list of that stream.
+                if item.stream_id in seenons_stream_ids:
+                    stream_dict.setdefault(item.stream_id, []).append(item.date)
+            return stream_dict
+
+    def _create_availability_dict_from_array(self, calendar, seenons_stream_ids):
+        # Same result as for the list of dicts, with the matching done on the whole array.
+        # Grouped in one pass, an AvailabilityIndex is only worth building to query it.
+        calendar = calendar.filter(calendar.stream_mask(seenons_stream_ids))
         stream_dict = {}
-        available_dates = []
-        for item in hague_dates:
-            # If stream ID of (filtered) dates dict is in the Seenons API list.
-            if item["afvalstroom_id"] in seenons_stream_ids:
-                # First append available date to the list of dates.
-                available_dates.append(item["ophaaldatum"])
-                # Then add waste stream ID as key to the dict and assign the dates list as its value.
-                stream_dict[item["afvalstroom_id"]] = available_dates
+        for stream_id, day in zip(
+            calendar.stream_ids.tolist(), calendar.date_strings().tolist()
+        ):
+            stream_dict.setdefault(stream_id, []).append(day)
         return stream_dict
+
+    def create_availability_index(self, calendar, seenons_stream_ids):
+        # AvailabilityIndex of the dates of the streams in the Seenons API list, for next
+        # pickup, date range and weekday queries (see availability_index.py).
+        return AvailabilityIndex.from_calendar(calendar, seenons_stream_ids)
+
+    def create_schedules(
+        self, hague_waste_streams, all_seenons_waste_streams, hague_dates
+    ):
+        # Recurrence rule (see schedule.py) per Seenons stream ID of the whole calendar.
+        calendar = self.create_calendar_array(
+            hague_waste_streams, all_seenons_waste_streams, hague_dates
+        )
+        with self.instrumentation.stage("create_schedules"):
+            return summarise_index(AvailabilityIndex.from_calendar(calendar))
+
+    def filter_dates_by_weekday(self, hague_dates, weekdays):
+        # Keep only the dates falling on one of the given weekdays (case insensitive), as set
+        # by add_weekday_to_hague_dates.
+        weekdays = [weekday.capitalize() for weekday in weekdays]
+        return [
+            d
+            for d in from_payloads(CollectionDate, hague_dates)
+            if d.weekday in weekdays
+        ]
+
+    def get_available_streams(
+        self,
+        hague_waste_streams,
+        all_seenons_waste_streams,
+        hague_dates,
+        seenons_stream_ids,
+        weekdays=None,
+    ):
+        # Run the full integration for one address: translate IDs, filter on weekdays and group per stream.
+        calendar = self.create_calendar_array(
+            hague_waste_streams, all_seenons_waste_streams, hague_dates
+        )
+        if weekdays is not None:
+            calendar = calendar.filter_weekdays(weekdays)
+        return self.create_availability_dict(calendar, seenons_stream_ids)
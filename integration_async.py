@@ -0,0 +1,101 @@
+import asyncio
+import aiohttp
+from datetime import date
+from integration_API import (
+    SEENONS_BASE,
+    HUISVUILKALENDAR,
+    SeenonsAPI,
+    HagueAPI,
+    Integration,
+)
+from single_flight import AsyncSingleFlight
+
+# Maximum number of simultaneous connections to a single API host.
+DEFAULT_LIMIT_PER_HOST = 10
+
+
+def create_session(limit_per_host=DEFAULT_LIMIT_PER_HOST):
+    # Pooled keep-alive client session shared by the async API clients.
+    connector = aiohttp.TCPConnector(limit_per_host=limit_per_host)
+    return aiohttp.ClientSession(connector=connector)
+
+
+async def fetch_json(session, url):
+    async with session.get(url) as response:
+        return await response.json(content_type=None)
+
+
+class AsyncAPIClient:
+    def __init__(self, session, base_url):
+        self.session = session
+        self.base_url = base_url
+        # Concurrent requests for the same URL share one upstream call (see single_flight.py).
+        self.single_flight = AsyncSingleFlight()
+
+    async def get_json(self, url):
+        # Get the JSON document at url. Results may be shared between tasks, do not mutate them.
+        return await self.single_flight.do(url, fetch_json, self.session, url)
+
+
+class AsyncSeenonsAPI(AsyncAPIClient):
+    def __init__(self, session, base_url=SEENONS_BASE):
+        super().__init__(session, base_url)
+
+    async def get_all_waste_streams(self):
+        # Get all waste streams from Seenons API.
+        return await self.get_json(self.base_url)
+
+    async def get_waste_streams_per_postcode(self, post_code):
+        # Get waste streams for given post code using the Seenons API.
+        url = f"{self.base_url}?postal_code={post_code}"
+        return await self.get_json(url)
+
+    get_list_of_stream_ids = SeenonsAPI.get_list_of_stream_ids
+
+
+class AsyncHagueAPI(AsyncAPIClient):
+    def __init__(self, session, base_url=HUISVUILKALENDAR):
+        super().__init__(session, base_url)
+
+    async def get_waste_streams(self, bag_id):
+        # Get 'afvalstromen' from the Huisvuilkalendar API.
+        url = f"{self.base_url}/rest/adressen/{bag_id}/afvalstromen"
+        return await self.get_json(url)
+
+    async def get_dates_per_stream(self, bag_id, year=None):
+        # Get dates and waste streams IDs from the Huisvuilkalendar API using bag ID.
+        year = year if year is not None else date.today().year
+        url = f"{self.base_url}/rest/adressen/{bag_id}/kalender/{year}"
+        return await self.get_json(url)
+
+    async def get_addresses(self, post_code, house_number):
+        # Get all addresses (one per house letter) for the post code and house number, empty list if none.
+        url = f"{self.base_url}/adressen/{post_code}:{house_number}"
+        return await self.get_json(url)
+
+    get_bagid = HagueAPI.get_bagid
+
+
+async def get_available_streams(
+    seenons_api, hague_api, post_code, bag_id, weekdays=None, integration=None
+):
+    # Fetch the four documents needed for one address concurrently, then run the integration.
+    integration = integration if integration is not None else Integration()
+    (
+        all_seenons_waste_streams,
+        seenons_streams_per_postcode,
+        hague_waste_streams,
+        hague_dates,
+    ) = await asyncio.gather(
+        seenons_api.get_all_waste_streams(),
+        seenons_api.get_waste_streams_per_postcode(post_code),
+        hague_api.get_waste_streams(bag_id),
+        hague_api.get_dates_per_stream(bag_id),
+    )
+    return integration.get_available_streams(
+        hague_waste_streams,
+        all_seenons_waste_streams,
+        hague_dates,
+        seenons_api.get_list_of_stream_ids(seenons_streams_per_postcode),
+        weekdays,
+    )
@@ -1,8 +1,8 @@
 import requests
 import argparse
-import inquirer
-import sys
 from datetime import datetime, date
+from types import MappingProxyType
+from stream_mapping import StreamMapping
 
 HUISVUILKALENDAR = "https://huisvuilkalender.denhaag.nl"
 SEENONS_BASE = "https://api-dev-593.seenons.com/api/me/streams"
@@ -10,11 +10,41 @@ QUERY_KEY = "postal_code"
 YEAR = date.today().year
 
 
-def get_all_waste_streams():
-    # Get all waste streams from Seenons API.
-    url = SEENONS_BASE
-    waste_streams = requests.get(url).json()
-    return waste_streams
+def freeze(document):
+    # Read-only version of a JSON document: dicts become mapping proxies and lists tuples.
+    if isinstance(document, dict):
+        return MappingProxyType({key: freeze(value) for key, value in document.items()})
+    if isinstance(document, list):
+        return tuple(freeze(value) for value in document)
+    return document
+
+
+class RequestPlan:
+    # Fetches every upstream document at most once per invocation. The documents are
+    # frozen because each one is shared by all steps that need it.
+
+    def __init__(self):
+        self.documents = {}
+
+    def fetch(self, url):
+        if url not in self.documents:
+            self.documents[url] = freeze(requests.get(url).json())
+        return self.documents[url]
+
+    def all_waste_streams(self):
+        return self.fetch(SEENONS_BASE)
+
+    def waste_streams_per_postcode(self, postalcode):
+        return self.fetch(f"{SEENONS_BASE}?{QUERY_KEY}={postalcode}")
+
+    def afvalstromen(self, bagid):
+        return self.fetch(f"{HUISVUILKALENDAR}/rest/adressen/{bagid}/afvalstromen")
+
+    def dates_per_stream(self, bagid):
+        return self.fetch(f"{HUISVUILKALENDAR}/rest/adressen/{bagid}/kalender/{YEAR}")
+
+    def house_info(self, postcode, housenumber):
+        return self.fetch(f"{HUISVUILKALENDAR}/adressen/{postcode}:{housenumber}")
 
 
 def get_waste_streams_per_postcode(postalcode):
@@ -24,13 +54,6 @@ def get_waste_streams_per_postcode(postalcode):
     return waste_streams
 
 
-def get_afvalstromen(bagid):
-    # Get 'afvalstromen' from the Huisvuilkalendar API.
-    url = f"{HUISVUILKALENDAR}/rest/adressen/{bagid}/afvalstromen"
-    afvalstromen = requests.get(url).json()
-    return afvalstromen
-
-
 def get_dates_per_stream(bagid):
     # Get dates and waste streams IDs from the Huisvuilkalendar API using bag ID.
     url = f"{HUISVUILKALENDAR}/rest/adressen/{bagid}/kalender/{YEAR}"
@@ -56,6 +79,9 @@ def choose_house_letter(house_info):
     letters = []
     # If house info contains more than one entry, prompt user to select house letter.
     if len(house_info) > 1:
+        # Only imported when prompting, so importing this module stays cheap.
+        import inquirer
+
         for item in house_info:
             letters.append(item["huisletter"])
         question = [
@@ -70,10 +96,10 @@ def choose_house_letter(house_info):
         return house_info[0]["huisletter"]
 
 
-def get_bagid(postcode, housenumber, houseletter):
-    # Get bag ID from the address details
-    url = f"{HUISVUILKALENDAR}/adressen/{postcode}:{housenumber}"
-    addresses = requests.get(url).json()
+def get_bagid(postcode, housenumber, houseletter, plan=None):
+    # Get bag ID from the address details, reusing the house info already fetched by the plan.
+    plan = plan if plan is not None else RequestPlan()
+    addresses = plan.house_info(postcode, housenumber)
     for address in addresses:
         if address["huisletter"] == houseletter:
             return address["bagid"]
@@ -82,91 +108,80 @@ def get_bagid(postcode, housenumber, houseletter):
 def create_availability_dict(dates, seenons_stream_ids):
     # Create a dict with matching stream ID as keys and all available dates per stream as values.
     stream_dict = {}
-    available_dates = []
     for item in dates:
-        # If stream ID of (filtered) dates dict is in the Seenons API list.
+        # If stream ID of (filtered) dates dict is in the Seenons API list,
+        # add the date to the dates list of that stream.
         if item["afvalstroom_id"] in seenons_stream_ids:
-            # First append available date to the list of dates.
-            available_dates.append(item["ophaaldatum"])
-            # Then add waste stream ID as key to the dict and assign the dates list as its value.
-            stream_dict[item["afvalstroom_id"]] = available_dates
+            stream_dict.setdefault(item["afvalstroom_id"], []).append(
+                item["ophaaldatum"]
+            )
     return stream_dict
 
 
-def translate_afvalstromen_to_seenons_id(all_waste_streams, afvalstromen):
-    # Change the IDs in afvalstromen to match Seenons API.
-    # All IDs are considered (0) until we find a match to the Seenons API.
-    for afvalstroom in afvalstromen:
-        afvalstroom["id"] = 0
-        for stream in all_waste_streams["items"]:
-            # If the stream product ID starts with the title in the afvalstroom, then overwrite afvalstroom ID.
-            if stream["type"].lower().startswith(afvalstroom["title"].lower()):
-                afvalstroom["id"] = stream["stream_product_id"]
-    # Keep in mind that returned list is mutated
-    return afvalstromen
-
-
-def modify_dates(bag_id, dates):
-    # Need to map 'afvalstrrom_id' value in dates list to that of Seenons API.
-    # First we get all afvalstromen for the given bag ID from the Huisvuilkalendar API.
-    afvalstromen = get_afvalstromen(bag_id)
-    # Then we get all available waste streams from the Seenons API.
-    all_waste_streams = get_all_waste_streams()
-    # Now we modify afvalstromen with the Seenons IDs.
-    new_afvalstromen = translate_afvalstromen_to_seenons_id(
-        all_waste_streams, afvalstromen
-    )
-    # Need to fetch afvalstromen list from the API again because it is mutated. Name it 'old' to distinguish.
-    old_afvalstromen = get_afvalstromen(bag_id)
+def modify_dates(bag_id, dates, plan=None):
+    # Need to map 'afvalstroom_id' value in dates list to that of Seenons API.
+    # Returns a new, read-only list of dates; the given dates are not changed.
+    plan = plan if plan is not None else RequestPlan()
+    # Get all afvalstromen for the given bag ID and all available waste streams from the Seenons API.
+    afvalstromen = plan.afvalstromen(bag_id)
+    all_waste_streams = plan.all_waste_streams()
     # Create dict to map old to new afvalstromen. Key is old id, value is new.
-    mapping_dict = {}
-    for index, item in enumerate(old_afvalstromen):
-        mapping_dict[item["id"]] = new_afvalstromen[index]["id"]
-    # Modify dates according to mapping dict
-    for item in dates:
-        if item["afvalstroom_id"] in mapping_dict:
-            item["afvalstroom_id"] = mapping_dict[item["afvalstroom_id"]]
-    # Add weekday info to the dates list
-    for item in dates:
-        item["weekday"] = translate_date_to_weekday(item["ophaaldatum"])
-    return dates
+    mapping_dict = StreamMapping.from_seenons_streams(all_waste_streams).id_map(
+        afvalstromen
+    )
+    # Modify dates according to mapping dict and add weekday info
+    return tuple(
+        MappingProxyType(
+            {
+                **item,
+                "afvalstroom_id": mapping_dict.get(
+                    item["afvalstroom_id"], item["afvalstroom_id"]
+                ),
+                "weekday": translate_date_to_weekday(item["ophaaldatum"]),
+            }
+        )
+        for item in dates
+    )
+
 
+def main(postcode, housenumber, weekdays=None, plan=None):
+    # Every upstream document is fetched once for the whole invocation.
+    plan = plan if plan is not None else RequestPlan()
 
-def main(postcode, housenumber, weekdays=None):
     # Get house info
-    house_info = get_house_info(postcode, housenumber)
-    # If post code / house number is wrong, we get an empty list for house info and need to exit.
-    if house_info == []:
+    house_info = plan.house_info(postcode, housenumber)
+    # If post code / house number is wrong, we get an empty list for house info and stop here.
+    if not house_info:
         print("Postal address does not exist")
-        sys.exit()
+        return
 
     # Get house letter
     house_letter = choose_house_letter(house_info)
     print(f"House letter: {house_letter}")
 
     # Get bag ID
-    bag_id = get_bagid(postcode, housenumber, house_letter)
+    bag_id = get_bagid(postcode, housenumber, house_letter, plan)
     print(f"Bag ID: {bag_id}")
 
     # Available waste streams for the postal code given (using Seenons API).
-    waste_streams = get_waste_streams_per_postcode(postcode)
+    waste_streams = plan.waste_streams_per_postcode(postcode)
     # Make list of available stream IDs.
     seenons_stream_ids = []
     for stream in waste_streams["items"]:
         seenons_stream_ids.append(stream["stream_product_id"])
 
     # Available dates per stream using Huisvuilkalendar API.
-    dates = get_dates_per_stream(bag_id)
+    dates = plan.dates_per_stream(bag_id)
 
     # Modify dates afvalstroom_id to match that of Seenons API and add weekday entry.
-    dates = modify_dates(bag_id, dates)
+    dates = modify_dates(bag_id, dates, plan)
 
     # Check if weekdays are given by the user, if so filter out dates accordingly.
     if weekdays is not None:
         # Format weekdays list in case user has used wrong case
         weekdays = [weekday.capitalize() for weekday in weekdays]
         # Need to filter dates list to contain only weekdays asked by the user.
-        dates[:] = [d for d in dates if d.get("weekday") in weekdays]
+        dates = tuple(d for d in dates if d.get("weekday") in weekdays)
 
     # Dictionary to save available waste stream data
     available_streams = create_availability_dict(dates, seenons_stream_ids)
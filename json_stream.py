@@ -0,0 +1,97 @@
+import codecs
+import json
+
+_decoder = json.JSONDecoder()
+WHITESPACE = " \t\n\r"
+
+
+class _Reader:
+    # Text buffer filled incrementally from an iterator of (byte or text) chunks.
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.utf8 = codecs.getincrementaldecoder("utf-8")()
+        self.buffer = ""
+        self.pos = 0
+        self.done = False
+
+    def read_more(self):
+        # Append the next chunk, dropping what was consumed. False at the end of the input.
+        if self.done:
+            return False
+        chunk = next(self.chunks, None)
+        if chunk is None:
+            self.done = True
+            chunk = self.utf8.decode(b"", final=True)
+        elif isinstance(chunk, bytes):
+            chunk = self.utf8.decode(chunk)
+        consumed = self.pos
+        self.buffer = self.buffer[consumed:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        # Next non-whitespace character without consuming it, "" at the end of the input.
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.read_more():
+                return ""
+
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Expected {char!r} in JSON stream, found {found!r}")
+        self.pos += 1
+
+    def value(self):
+        # Decode the next complete JSON value, reading more input while it is incomplete.
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.pos)
+                # A number at the very end of the buffer may continue in the next chunk.
+                if end < len(self.buffer) or self.done:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.done:
+                    raise
+            self.read_more()
+
+
+def _array_items(reader, fields):
+    reader.expect("[")
+    if reader.peek() == "]":
+        return
+    while True:
+        item = reader.value()
+        if fields is not None:
+            item = {field: item[field] for field in fields if field in item}
+        yield item
+        if reader.peek() == "]":
+            return
+        reader.expect(",")
+
+
+def iter_items(chunks, key=None, fields=None):
+    # Yield the elements of a JSON array one by one while the document is still being read.
+    # The array is the document itself, or the value of `key` in the top level object
+    # (e.g. "items" of the Seenons API). With fields, only those fields of each element are kept.
+    reader = _Reader(chunks)
+    if key is None:
+        yield from _array_items(reader, fields)
+        return
+    reader.expect("{")
+    while reader.peek() not in ("}", ""):
+        name = reader.value()
+        reader.expect(":")
+        if name == key:
+            yield from _array_items(reader, fields)
+            return
+        # Other top level values are small (e.g. "totalItems") and decoded to skip them.
+        reader.value()
+        if reader.peek() == ",":
+            reader.expect(",")
@@ -0,0 +1,69 @@
+from collections import namedtuple
+
+# Immutable records for the API payloads the integration uses. Like Schedule they are
+# namedtuples without an instance dict (__slots__ = ()), so an entry takes a small tuple
+# instead of a dict with every upstream field, they can be shared between addresses and
+# threads without copying, and they pickle compactly to worker processes.
+
+
+class Address(
+    namedtuple("Address", ["bag_id", "post_code", "house_number", "house_letter"])
+):
+    # One address of the Huisvuilkalendar 'adressen' lookup.
+    __slots__ = ()
+
+    @classmethod
+    def from_payload(cls, payload):
+        return cls(
+            payload["bagid"],
+            payload.get("postcode"),
+            payload.get("huisnummer"),
+            payload.get("huisletter"),
+        )
+
+
+class SeenonsStream(namedtuple("SeenonsStream", ["id", "type"])):
+    # One item of the Seenons streams API.
+    __slots__ = ()
+
+    @classmethod
+    def from_payload(cls, payload):
+        return cls(payload["stream_product_id"], payload["type"])
+
+
+class HagueStream(namedtuple("HagueStream", ["id", "title"])):
+    # One of the Huisvuilkalendar 'afvalstromen' of an address.
+    __slots__ = ()
+
+    @classmethod
+    def from_payload(cls, payload):
+        return cls(payload["id"], payload["title"])
+
+
+class CollectionDate(
+    namedtuple("CollectionDate", ["stream_id", "date", "weekday"], defaults=(None,))
+):
+    # One Huisvuilkalendar 'kalender' entry: a stream ID and an ISO collection date, and its
+    # weekday name (Monday, Tuesday etc) once Integration.add_weekday_to_hague_dates set it.
+    __slots__ = ()
+
+    @classmethod
+    def from_payload(cls, payload):
+        return cls(
+            payload["afvalstroom_id"], payload["ophaaldatum"], payload.get("weekday")
+        )
+
+    def to_payload(self):
+        # Back to the 'kalender' entry format, with the weekday name if it is set.
+        payload = {"afvalstroom_id": self.stream_id, "ophaaldatum": self.date}
+        if self.weekday is not None:
+            payload["weekday"] = self.weekday
+        return payload
+
+
+def from_payloads(model, payloads):
+    # List of models of the payloads (an iterable of dicts); models are passed through as is.
+    return [
+        payload if isinstance(payload, model) else model.from_payload(payload)
+        for payload in payloads
+    ]
@@ -0,0 +1,162 @@
+import bisect
+import json
+from integration_API import HagueAPI, HUISVUILKALENDAR
+from content_store import ContentStore
+from single_flight import SingleFlight
+from transport import Transport
+
+# Municipalities served by default: name, CBS municipality code (the first 4 digits of the
+# bag IDs of its addresses), ranges of the 4 digit part of its post codes and calendar API.
+DEFAULT_MUNICIPALITIES = [
+    {
+        "name": "Den Haag",
+        "code": "0518",
+        "postcodes": [[2491, 2599]],
+        "base_url": HUISVUILKALENDAR,
+    },
+]
+
+
+class UnknownMunicipalityError(LookupError):
+    # No calendar backend is registered for the post code or bag ID.
+    pass
+
+
+def postcode_number(post_code):
+    # The 4 digit part of a Dutch post code (e.g. 2512 for 2512HE).
+    digits = post_code.strip()[:4]
+    if len(digits) != 4 or not digits.isdigit():
+        raise UnknownMunicipalityError(f"Invalid post code {post_code}")
+    return int(digits)
+
+
+class MunicipalityRouter:
+    # Calendar API for several municipalities, used like a HagueAPI (e.g. by AddressResolver).
+    # Each municipality has a backend implementing the HagueAPI interface: get_addresses by
+    # post code and house number, and get_waste_streams / get_dates_per_stream by bag ID.
+    # Address lookups are routed by post code range, bag ID lookups by municipality code.
+    # Backends created by add share one Transport (connection pool, rate limits and circuit
+    # state per host), ResponseCache, ContentStore and single flight.
+
+    def __init__(self, session=None, cache=None, instrumentation=None):
+        self.transport = (
+            session if isinstance(session, Transport) else Transport(session)
+        )
+        self.cache = cache
+        self.instrumentation = instrumentation
+        self.documents = ContentStore()
+        self.single_flight = SingleFlight()
+        # Backend and name per municipality code.
+        self.backends = {}
+        self.names = {}
+        # Registered (first, last, code) post code ranges, sorted by first.
+        self._ranges = []
+
+    @classmethod
+    def from_config(
+        cls, municipalities, session=None, cache=None, instrumentation=None
+    ):
+        # Router with a HagueAPI-style backend per entry of a list like DEFAULT_MUNICIPALITIES.
+        router = cls(session, cache, instrumentation)
+        for municipality in municipalities:
+            router.add(
+                municipality["name"],
+                municipality["code"],
+                municipality["postcodes"],
+                municipality["base_url"],
+            )
+        return router
+
+    @classmethod
+    def load(cls, path, session=None, cache=None, instrumentation=None):
+        # Router for the municipalities in a JSON file (a list like DEFAULT_MUNICIPALITIES).
+        with open(path) as config_file:
+            return cls.from_config(
+                json.load(config_file), session, cache, instrumentation
+            )
+
+    def add(self, name, code, postcode_ranges, base_url, backend_class=HagueAPI):
+        # Create and register a backend_class(session, base_url, cache, instrumentation)
+        # sharing the router's transport, cache and parsed documents.
+        backend = backend_class(
+            self.transport, base_url, self.cache, self.instrumentation
+        )
+        backend.documents = self.documents
+        backend.single_flight = self.single_flight
+        return self.register(name, code, postcode_ranges, backend)
+
+    def register(self, name, code, postcode_ranges, backend):
+        # Route the post code ranges ([first, last] of the 4 digit part, inclusive) and the
+        # bag IDs starting with code to backend. Raises ValueError for overlapping ranges.
+        ranges = sorted(
+            self._ranges + [(first, last, code) for first, last in postcode_ranges]
+        )
+        for (_, last, _), (first, _, _) in zip(ranges, ranges[1:]):
+            if first <= last:
+                raise ValueError(f"Post code ranges of {name} overlap at {first}")
+        self._ranges = ranges
+        self.backends[code] = backend
+        self.names[code] = name
+        return backend
+
+    def municipality_code(self, post_code):
+        number = postcode_number(post_code)
+        i = bisect.bisect_right(self._ranges, (number, float("inf"))) - 1
+        if i < 0 or number > self._ranges[i][1]:
+            raise UnknownMunicipalityError(
+                f"No calendar backend for post code {post_code}"
+            )
+        return self._ranges[i][2]
+
+    def municipality(self, post_code):
+        # Name of the municipality serving the post code.
+        return self.names[self.municipality_code(post_code)]
+
+    def backend_for_postcode(self, post_code):
+        return self.backends[self.municipality_code(post_code)]
+
+    def backend_for_bagid(self, bag_id):
+        backend = self.backends.get(bag_id[:4])
+        if backend is None:
+            raise UnknownMunicipalityError(f"No calendar backend for bag ID {bag_id}")
+        return backend
+
+    def get_addresses(self, post_code, house_number):
+        return self.backend_for_postcode(post_code).get_addresses(
+            post_code, house_number
+        )
+
+    get_house_info = HagueAPI.get_house_info
+    get_bagid = HagueAPI.get_bagid
+
+    def get_waste_streams(self, bag_id):
+        return self.backend_for_bagid(bag_id).get_waste_streams(bag_id)
+
+    def get_dates_per_stream(self, bag_id, year=None):
+        return self.backend_for_bagid(bag_id).get_dates_per_stream(bag_id, year)
+
+    def iter_dates_per_stream(
+        self, bag_id, fields=("afvalstroom_id", "ophaaldatum"), year=None
+    ):
+        return self.backend_for_bagid(bag_id).iter_dates_per_stream(
+            bag_id, fields, year
+        )
+
+    def get_dates_in_range(self, bag_id, start, end):
+        return self.backend_for_bagid(bag_id).get_dates_in_range(bag_id, start, end)
+
+    def iter_dates_in_range(
+        self, bag_id, start, end, fields=("afvalstroom_id", "ophaaldatum")
+    ):
+        return self.backend_for_bagid(bag_id).iter_dates_in_range(
+            bag_id, start, end, fields
+        )
+
+
+def create_router(path=None, session=None, cache=None, instrumentation=None):
+    # Router for the municipalities in the JSON file at path, or DEFAULT_MUNICIPALITIES.
+    if path:
+        return MunicipalityRouter.load(path, session, cache, instrumentation)
+    return MunicipalityRouter.from_config(
+        DEFAULT_MUNICIPALITIES, session, cache, instrumentation
+    )
@@ -0,0 +1,79 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from integration_API import Integration
+from stream_mapping import StreamMapping
+
+# Addresses integrated per task sent to a worker process.
+DEFAULT_SHARD_SIZE = 64
+
+# State shared by all tasks of a worker process, set once by _init_worker.
+_worker = {}
+
+
+def _init_worker(stream_mapping, weekdays):
+    # Runs once in every worker process, so the stream mapping is not sent along with each task.
+    _worker["integration"] = Integration()
+    _worker["stream_mapping"] = StreamMapping.from_dict(stream_mapping)
+    _worker["weekdays"] = weekdays
+
+
+def _integrate_shard(shard):
+    # Available dates per stream for each (hague_waste_streams, hague_dates, seenons_stream_ids).
+    integration = _worker["integration"]
+    return [
+        integration.get_available_streams(
+            hague_waste_streams,
+            _worker["stream_mapping"],
+            hague_dates,
+            seenons_stream_ids,
+            _worker["weekdays"],
+        )
+        for hague_waste_streams, hague_dates, seenons_stream_ids in shard
+    ]
+
+
+def _shards(items, size):
+    shard = []
+    for item in items:
+        shard.append(item)
+        if len(shard) == size:
+            yield shard
+            shard = []
+    if shard:
+        yield shard
+
+
+def _merge(shard, future):
+    # Pair the keys of a shard with the results of its integrated documents.
+    results = iter(future.result())
+    for key, documents in shard:
+        yield key, next(results) if documents is not None else None
+
+
+def integrate_parallel(
+    stream_mapping,
+    items,
+    weekdays=None,
+    processes=None,
+    shard_size=DEFAULT_SHARD_SIZE,
+):
+    # Run the integration of many addresses on a pool of worker processes.
+    # items are (key, documents) pairs, documents being the (hague_waste_streams, hague_dates,
+    # seenons_stream_ids) inputs of Integration.get_available_streams, or None to pass the key
+    # through. Yields (key, available_streams or None) in input order. Items are sent in shards
+    # of shard_size addresses, with at most two shards per process in flight.
+    processes = processes or os.cpu_count()
+    with ProcessPoolExecutor(
+        max_workers=processes,
+        initializer=_init_worker,
+        initargs=(stream_mapping.to_dict(), weekdays),
+    ) as executor:
+        pending = deque()
+        for shard in _shards(items, shard_size):
+            documents = [documents for _, documents in shard if documents is not None]
+            pending.append((shard, executor.submit(_integrate_shard, documents)))
+            if len(pending) >= processes * 2:
+                yield from _merge(*pending.popleft())
+        while pending:
+            yield from _merge(*pending.popleft())
@@ -0,0 +1,250 @@
+import threading
+from concurrent.futures import Future
+from integration_API import SeenonsAPI, HagueAPI, Integration, AddressNotFoundError
+from stream_mapping import StreamMapping
+from schedule import ScheduleCache
+from content_store import LRUCache
+from models import Address, SeenonsStream, from_payloads
+
+
+class AddressResolver:
+    # Resolves addresses to available waste streams, fetching every shared lookup only once.
+    # The Seenons stream catalogue is fetched once, Seenons streams once per post code and
+    # the Huisvuilkalendar house info once per post code and house number.
+    # With memoize_lookups=False only the catalogue and stream mapping are kept, for
+    # long-running processes that leave the other lookups to a ResponseCache.
+    # With streaming=True the catalogue and calendars are parsed while they download,
+    # keeping only the fields the integration uses (this bypasses the ResponseCache).
+
+    def __init__(
+        self,
+        seenons_api=None,
+        hague_api=None,
+        integration=None,
+        stream_mapping=None,
+        memoize_lookups=True,
+        streaming=False,
+    ):
+        self.seenons_api = seenons_api if seenons_api is not None else SeenonsAPI()
+        self.hague_api = hague_api if hague_api is not None else HagueAPI()
+        self.integration = integration if integration is not None else Integration()
+        self.memoize_lookups = memoize_lookups
+        self.streaming = streaming
+        self._lock = threading.Lock()
+        self._lookups = {}
+        # Integration results and collection schedules per distinct 'afvalstromen' and
+        # calendar content, so addresses sharing a calendar are integrated once.
+        self.results = LRUCache()
+        self.schedules = ScheduleCache()
+        # A stored StreamMapping saves fetching the Seenons catalogue altogether.
+        if stream_mapping is not None:
+            self._lookups[("mapping",)] = Future()
+            self._lookups[("mapping",)].set_result(stream_mapping)
+
+    def _lookup(self, key, fetch, *args):
+        # Run fetch once per key and share its result with every (concurrent) caller.
+        with self._lock:
+            future = self._lookups.get(key)
+            owner = future is None
+            if owner:
+                future = self._lookups[key] = Future()
+        if owner:
+            try:
+                future.set_result(fetch(*args))
+            except Exception as error:
+                # Forget failed lookups so later addresses retry instead of reusing the error.
+                with self._lock:
+                    del self._lookups[key]
+                future.set_exception(error)
+        return future.result()
+
+    def get_all_waste_streams(self):
+        return self._lookup(("seenons",), self.seenons_api.get_all_waste_streams)
+
+    def get_stream_mapping(self):
+        # Translation index built once from the Seenons catalogue.
+        return self._lookup(("mapping",), self._build_stream_mapping)
+
+    def _build_stream_mapping(self):
+        if self.streaming:
+            return StreamMapping.from_items(self.seenons_api.iter_all_waste_streams())
+        return StreamMapping.from_seenons_streams(self.get_all_waste_streams())
+
+    def get_dates_per_stream(self, bag_id, start=None, end=None):
+        # The current year's calendar, or the entries from start to end (dates) when given.
+        if start is not None and end is not None:
+            if self.streaming:
+                return self.hague_api.iter_dates_in_range(bag_id, start, end)
+            return self.hague_api.get_dates_in_range(bag_id, start, end)
+        if self.streaming:
+            return self.hague_api.iter_dates_per_stream(bag_id)
+        return self.hague_api.get_dates_per_stream(bag_id)
+
+    # The memoised lookups keep only SeenonsStream and Address models, not whole payloads.
+
+    def get_waste_streams_per_postcode(self, post_code):
+        # SeenonsStreams available at the post code.
+        if not self.memoize_lookups:
+            return self._fetch_waste_streams_per_postcode(post_code)
+        return self._lookup(
+            ("postcode", post_code),
+            self._fetch_waste_streams_per_postcode,
+            post_code,
+        )
+
+    def _fetch_waste_streams_per_postcode(self, post_code):
+        streams = self.seenons_api.get_waste_streams_per_postcode(post_code)
+        return from_payloads(SeenonsStream, streams["items"])
+
+    def get_addresses(self, post_code, house_number):
+        # Addresses (one per house letter) of the post code and house number.
+        if not self.memoize_lookups:
+            return self._fetch_addresses(post_code, house_number)
+        return self._lookup(
+            ("address", post_code, house_number),
+            self._fetch_addresses,
+            post_code,
+            house_number,
+        )
+
+    def _fetch_addresses(self, post_code, house_number):
+        return from_payloads(
+            Address, self.hague_api.get_addresses(post_code, house_number)
+        )
+
+    def fetch(self, post_code, house_number, house_letter=None, start=None, end=None):
+        # Fetch everything the integration of one address needs. Returns the record (with its
+        # bag ID or an error), the (hague_waste_streams, hague_dates, seenons_stream_ids)
+        # integration inputs and the Seenons stream types, both None for an error record.
+        record = {
+            "postcode": post_code,
+            "housenumber": house_number,
+            "houseletter": house_letter,
+        }
+        addresses = self.get_addresses(post_code, house_number)
+        if addresses == []:
+            record["error"] = "Postal address does not exist"
+            return record, None, None
+        # Without a house letter the single address is used, like choose_house_letter does.
+        if house_letter is None and len(addresses) == 1:
+            house_letter = addresses[0].house_letter
+            record["houseletter"] = house_letter
+        elif house_letter is None:
+            # Quoted, so the empty letter of an address without one shows up as "".
+            letters = ", ".join(f'"{address.house_letter}"' for address in addresses)
+            record["error"] = f"House letter required, one of {letters}"
+            return record, None, None
+        bag_id = self.hague_api.get_bagid(addresses, house_letter)
+        if bag_id is None:
+            record["error"] = "House letter does not exist"
+            return record, None, None
+        record["bagid"] = bag_id
+
+        seenons_streams_per_postcode = self.get_waste_streams_per_postcode(post_code)
+        documents = (
+            self.hague_api.get_waste_streams(bag_id),
+            self.get_dates_per_stream(bag_id, start, end),
+            [stream.id for stream in seenons_streams_per_postcode],
+        )
+        stream_types = {
+            stream.id: stream.type for stream in seenons_streams_per_postcode
+        }
+        return record, documents, stream_types
+
+    def content_key(self, hague_waste_streams, hague_dates):
+        # Digests of the documents as loaded by the Hague API client (see content_store.py),
+        # None if either was not (e.g. streamed or filtered to a date range).
+        documents = getattr(self.hague_api, "documents", None)
+        if documents is None:
+            return None
+        digests = (documents.digest(hague_waste_streams), documents.digest(hague_dates))
+        return None if None in digests else digests
+
+    def get_available_streams(self, documents, weekdays=None):
+        # Integration of the documents fetched for an address (see fetch), computed once per
+        # distinct content. The result is shared between addresses, do not mutate it.
+        hague_waste_streams, hague_dates, seenons_stream_ids = documents
+
+        def integrate():
+            return self.integration.get_available_streams(
+                hague_waste_streams,
+                self.get_stream_mapping(),
+                hague_dates,
+                seenons_stream_ids,
+                weekdays,
+            )
+
+        key = self.content_key(hague_waste_streams, hague_dates)
+        if key is None:
+            return integrate()
+        weekdays = tuple(weekdays) if weekdays is not None else None
+        return self.results.get(key + (tuple(seenons_stream_ids), weekdays), integrate)
+
+    def add_streams(self, record, available_streams, stream_types):
+        # Complete the record with the available dates per stream from the integration.
+        record["streams"] = [
+            {"id": stream_id, "type": stream_types.get(stream_id), "dates": dates}
+            for stream_id, dates in available_streams.items()
+        ]
+        return record
+
+    def resolve(
+        self,
+        post_code,
+        house_number,
+        house_letter=None,
+        weekdays=None,
+        start=None,
+        end=None,
+    ):
+        # Resolve one address to a record with its bag ID and the available dates per stream,
+        # optionally only those from start up to and including end.
+        record, documents, stream_types = self.fetch(
+            post_code, house_number, house_letter, start, end
+        )
+        if documents is None:
+            return record
+        available_streams = self.get_available_streams(documents, weekdays)
+        return self.add_streams(record, available_streams, stream_types)
+
+    def summarise(self, post_code, house_number, house_letter=None):
+        # Like resolve, with a recurrence rule per stream (e.g. every other Tuesday, see
+        # schedule.py) instead of its dates. Schedules are computed once per bag ID.
+        record, documents, stream_types = self.fetch(
+            post_code, house_number, house_letter
+        )
+        if documents is None:
+            return record
+        hague_waste_streams, hague_dates, seenons_stream_ids = documents
+        key = self.content_key(hague_waste_streams, hague_dates)
+        schedules = self.schedules.get(
+            key or record["bagid"],
+            lambda: self.integration.create_schedules(
+                hague_waste_streams, self.get_stream_mapping(), hague_dates
+            ),
+        )
+        record["streams"] = [
+            {
+                "id": stream_id,
+                "type": stream_types.get(stream_id),
+                "schedule": schedule.to_dict(),
+            }
+            for stream_id, schedule in schedules.items()
+            if stream_id in seenons_stream_ids
+        ]
+        return record
+
+    def resolve_all(self, post_code, house_number, weekdays=None, start=None, end=None):
+        # Records (see resolve) for every house letter of the post code and house number,
+        # without prompting. Raises AddressNotFoundError for an unknown address.
+        addresses = self.get_addresses(post_code, house_number)
+        if addresses == []:
+            raise AddressNotFoundError(
+                f"Postal address {post_code} {house_number} does not exist"
+            )
+        return [
+            self.resolve(
+                post_code, house_number, address.house_letter, weekdays, start, end
+            )
+            for address in addresses
+        ]
@@ -0,0 +1,152 @@
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from content_store import content_digest
+
+# Time to live in seconds per endpoint. Calendars and 'afvalstromen' change a few times
+# a year, Seenons streams per post code follow the (changing) Seenons service area.
+# Calendars of past years are final, the current year's calendar is revalidated hourly.
+DEFAULT_TTLS = {
+    "hague_kalender": 3600,
+    "hague_kalender_past": 365 * 24 * 3600,
+    "hague_kalender_next": 7 * 24 * 3600,
+    "hague_afvalstromen": 7 * 24 * 3600,
+    "hague_adressen": 24 * 3600,
+    "seenons_streams": 24 * 3600,
+    "seenons_postcode_streams": 15 * 60,
+}
+DEFAULT_TTL = 3600
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+class CacheEntry(
+    namedtuple("CacheEntry", ["body", "etag", "last_modified", "expires_at"])
+):
+    __slots__ = ()
+
+    def is_fresh(self, now=None):
+        return (time.time() if now is None else now) < self.expires_at
+
+    def validators(self):
+        # Conditional request headers to revalidate an expired entry upstream.
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class ResponseCache:
+    # SQLite backed cache of API response bodies keyed by URL, with per-endpoint TTLs
+    # and least recently used eviction once the stored bodies exceed max_bytes.
+    # Bodies are stored once per distinct content (by digest, see content_store.py) and
+    # referenced by their URLs, so identical calendars of many addresses take the space of one.
+    # Use ":memory:" as path for a cache that only lives as long as the process.
+
+    def __init__(self, path=":memory:", max_bytes=DEFAULT_MAX_BYTES, ttls=None):
+        self.max_bytes = max_bytes
+        self.ttls = {**DEFAULT_TTLS, **(ttls or {})}
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "url TEXT PRIMARY KEY, digest TEXT NOT NULL, etag TEXT, last_modified TEXT, "
+            "expires_at REAL NOT NULL, accessed_at REAL NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed_at);"
+            "CREATE INDEX IF NOT EXISTS entries_digest ON entries (digest);"
+            "CREATE TABLE IF NOT EXISTS blobs ("
+            "digest TEXT PRIMARY KEY, body TEXT NOT NULL, size INTEGER NOT NULL) "
+            "WITHOUT ROWID;"
+        )
+        self._size = self._stored_size()
+
+    def _stored_size(self):
+        return self._db.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[
+            0
+        ]
+
+    def ttl(self, endpoint):
+        return self.ttls.get(endpoint, DEFAULT_TTL)
+
+    def get(self, url):
+        # Get the cached entry for url (fresh or expired), None if it is not cached.
+        with self._lock, self._db:
+            row = self._db.execute(
+                "SELECT body, etag, last_modified, expires_at "
+                "FROM entries JOIN blobs USING (digest) WHERE url = ?",
+                (url,),
+            ).fetchone()
+            if row is None:
+                return None
+            self._db.execute(
+                "UPDATE entries SET accessed_at = ? WHERE url = ?", (time.time(), url)
+            )
+        return CacheEntry(*row)
+
+    def put(self, url, body, endpoint, etag=None, last_modified=None):
+        now = time.time()
+        digest = content_digest(body)
+        with self._lock, self._db:
+            stored = self._db.execute(
+                "INSERT OR IGNORE INTO blobs VALUES (?, ?, ?)",
+                (digest, body, len(body)),
+            ).rowcount
+            self._size += len(body) if stored else 0
+            old = self._db.execute(
+                "SELECT digest FROM entries WHERE url = ?", (url,)
+            ).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+                (url, digest, etag, last_modified, now + self.ttl(endpoint), now),
+            )
+            if old and old[0] != digest:
+                self._drop_unreferenced([old[0]])
+            self._evict()
+
+    def touch(self, url, endpoint):
+        # Extend the lifetime of an entry after upstream confirmed it did not change (304).
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE entries SET expires_at = ?, accessed_at = ? WHERE url = ?",
+                (now + self.ttl(endpoint), now, url),
+            )
+
+    def _drop_unreferenced(self, digests):
+        # Delete the bodies no URL refers to anymore.
+        for digest in digests:
+            row = self._db.execute(
+                "SELECT size FROM blobs WHERE digest = ? AND NOT EXISTS "
+                "(SELECT 1 FROM entries WHERE entries.digest = blobs.digest)",
+                (digest,),
+            ).fetchone()
+            if row is not None:
+                self._db.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+                self._size -= row[0]
+
+    def _evict(self):
+        # Drop least recently used entries until the cache fits in max_bytes again.
+        while self._size > self.max_bytes:
+            rows = self._db.execute(
+                "SELECT url, digest FROM entries ORDER BY accessed_at LIMIT 64"
+            ).fetchall()
+            if not rows:
+                break
+            for url, digest in rows:
+                self._db.execute("DELETE FROM entries WHERE url = ?", (url,))
+                self._drop_unreferenced([digest])
+                if self._size <= self.max_bytes:
+                    break
+
+    def clear(self):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM entries")
+            self._db.execute("DELETE FROM blobs")
+            self._size = 0
+
+    def close(self):
+        self._db.close()
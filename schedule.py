@@ -0,0 +1,109 @@
+from collections import namedtuple
+import numpy as np
+from calendar_array import EPOCH_WEEKDAY, WEEKDAYS
+from content_store import LRUCache
+
+# Bag IDs whose schedules a ScheduleCache keeps.
+DEFAULT_CACHE_SIZE = 10000
+
+
+def day_string(day):
+    return str(np.datetime64(int(day), "D"))
+
+
+def day_strings(days):
+    return [day_string(day) for day in days]
+
+
+class Schedule(
+    namedtuple(
+        "Schedule", ["weekday", "interval_weeks", "first", "last", "extra", "missing"]
+    )
+):
+    # Recurrence rule of one stream's collection dates: every interval_weeks weeks on weekday,
+    # from the first regular collection up to and including the last date, plus the extra
+    # dates and without the missing ones (e.g. a collection moved to the next day around
+    # Christmas). Streams without a regular pattern have weekday and interval_weeks None and
+    # all their dates in extra.
+    __slots__ = ()
+
+    @classmethod
+    def from_days(cls, days):
+        # Summarise sorted day numbers (days since 1970-01-01, see AvailabilityIndex).
+        days = np.asarray(days, dtype=np.int64)
+        weekdays = (days + EPOCH_WEEKDAY) % 7
+        weekday = int(np.bincount(weekdays, minlength=7).argmax())
+        on_weekday = days[weekdays == weekday]
+        gaps = np.diff(on_weekday) // 7
+        gaps = gaps[gaps > 0]
+        if len(gaps) == 0:
+            return cls(
+                None,
+                None,
+                day_string(days[0]),
+                day_string(days[-1]),
+                day_strings(days),
+                [],
+            )
+        # The most common number of weeks between collections, starting at the first one.
+        interval = int(np.bincount(gaps).argmax())
+        expected = np.arange(on_weekday[0], days[-1] + 1, interval * 7)
+        return cls(
+            WEEKDAYS[weekday],
+            interval,
+            day_string(on_weekday[0]),
+            day_string(days[-1]),
+            day_strings(np.setdiff1d(days, expected)),
+            day_strings(np.setdiff1d(expected, days)),
+        )
+
+    def dates(self):
+        # Expand back to the sorted list of ISO collection dates.
+        days = set(self.extra)
+        if self.interval_weeks is not None:
+            expected = np.arange(
+                np.datetime64(self.first, "D"),
+                np.datetime64(self.last, "D") + 1,
+                7 * self.interval_weeks,
+            )
+            days.update(day_strings(expected.astype(np.int64)))
+        return sorted(days - set(self.missing))
+
+    def describe(self):
+        # Human readable summary, e.g. "every other Tuesday".
+        if self.interval_weeks is None:
+            return "on " + ", ".join(self.extra)
+        if self.interval_weeks == 1:
+            text = f"every {self.weekday}"
+        elif self.interval_weeks == 2:
+            text = f"every other {self.weekday}"
+        else:
+            text = f"every {self.interval_weeks} weeks on {self.weekday}"
+        if self.missing:
+            text += ", except " + ", ".join(self.missing)
+        if self.extra:
+            text += ", also on " + ", ".join(self.extra)
+        return text
+
+    def to_dict(self):
+        return {**self._asdict(), "description": self.describe()}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(*(data[field] for field in cls._fields))
+
+
+def summarise_index(index):
+    # Schedule per stream ID of an AvailabilityIndex.
+    return {
+        stream_id: Schedule.from_days(stream_days)
+        for stream_id, stream_days in index.days.items()
+        if len(stream_days)
+    }
+
+
+class ScheduleCache(LRUCache):
+    # Schedules per bag ID (or calendar content), kept for the max_size most recently used.
+
+    def __init__(self, max_size=DEFAULT_CACHE_SIZE):
+        super().__init__(max_size)
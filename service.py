@@ -0,0 +1,179 @@
+import argparse
+import threading
+import time
+import requests
+from flask import Flask, request
+from flask_restful import Api, Resource
+from integration_API import (
+    SeenonsAPI,
+    Integration,
+    create_session,
+    upcoming_window,
+)
+from resolver import AddressResolver
+from response_cache import ResponseCache
+from calendar_store import CalendarStore, NotInStoreError, OfflineHagueAPI
+from instrumentation import Instrumentation, MetricsSink
+from transport import Transport
+from municipalities import UnknownMunicipalityError, create_router
+
+# Seconds the Seenons catalogue and stream mapping are kept in memory before a refresh.
+CATALOGUE_TTL = 3600
+DEFAULT_POOL_SIZE = 32
+
+
+class AvailabilityService:
+    # Keeps an AddressResolver with the Seenons catalogue and stream mapping warm in memory,
+    # replacing it with a fresh one every catalogue_ttl seconds.
+
+    def __init__(
+        self,
+        seenons_api,
+        hague_api,
+        catalogue_ttl=CATALOGUE_TTL,
+        integration=None,
+        metrics=None,
+    ):
+        self.seenons_api = seenons_api
+        self.hague_api = hague_api
+        self.catalogue_ttl = catalogue_ttl
+        self.integration = integration
+        # MetricsSink served on /metrics, if any.
+        self.metrics = metrics
+        self._lock = threading.Lock()
+        self._resolver = None
+        self._expires_at = 0
+
+    def warm_up(self):
+        # Fetch the catalogue and build the mapping before the first request comes in.
+        resolver = AddressResolver(
+            self.seenons_api, self.hague_api, self.integration, memoize_lookups=False
+        )
+        resolver.get_stream_mapping()
+        with self._lock:
+            self._resolver = resolver
+            self._expires_at = time.monotonic() + self.catalogue_ttl
+        return resolver
+
+    def get_resolver(self):
+        with self._lock:
+            if self._resolver is not None and time.monotonic() < self._expires_at:
+                return self._resolver
+        return self.warm_up()
+
+
+def parse_weekdays(values):
+    # Weekdays can be given as repeated parameters and / or comma separated.
+    weekdays = [day.strip() for value in values for day in value.split(",")]
+    weekdays = [day for day in weekdays if day]
+    return weekdays or None
+
+
+class Availability(Resource):
+    def __init__(self, service):
+        self.service = service
+
+    def get(self):
+        post_code = request.args.get("postcode")
+        house_number = request.args.get("number")
+        if not post_code or not house_number:
+            return {"error": "postcode and number are required"}, 400
+        # Optionally only the pickups of the coming number of weeks.
+        weeks = request.args.get("weeks", type=int)
+        start, end = upcoming_window(weeks) if weeks else (None, None)
+        try:
+            resolver = self.service.get_resolver()
+            # With summary=1 each stream has its collection schedule instead of its dates.
+            if request.args.get("summary") in ("1", "true"):
+                record = resolver.summarise(
+                    post_code, house_number, request.args.get("letter")
+                )
+            else:
+                record = resolver.resolve(
+                    post_code,
+                    house_number,
+                    request.args.get("letter"),
+                    parse_weekdays(request.args.getlist("weekday")),
+                    start,
+                    end,
+                )
+        except (UnknownMunicipalityError, NotInStoreError) as error:
+            # No calendar backend, or no calendar in the offline store: not an upstream failure.
+            return {"error": str(error)}, 404
+        except (requests.RequestException, ValueError, LookupError) as error:
+            return {"error": f"Upstream API failed: {error}"}, 502
+        return record, 404 if "error" in record else 200
+
+
+def create_service(
+    pool_size=DEFAULT_POOL_SIZE,
+    cache_path=":memory:",
+    store_path=None,
+    municipalities_path=None,
+):
+    # Service whose APIs share a pooled HTTP session behind one Transport (timeouts, retries
+    # and a circuit breaker per host) and a response cache, which serves expired responses
+    # while their upstream is down. Calendars come from the calendar store if given, else
+    # from the backend of the address' municipality (see municipalities.py).
+    session = Transport(create_session(pool_size))
+    cache = ResponseCache(cache_path)
+    metrics = MetricsSink()
+    instrumentation = Instrumentation([metrics])
+    if store_path:
+        hague_api = OfflineHagueAPI(CalendarStore(store_path))
+    else:
+        hague_api = create_router(municipalities_path, session, cache, instrumentation)
+    seenons_api = SeenonsAPI(session, cache=cache, instrumentation=instrumentation)
+    return AvailabilityService(
+        seenons_api,
+        hague_api,
+        integration=Integration(instrumentation),
+        metrics=metrics,
+    )
+
+
+def create_app(service=None):
+    service = service if service is not None else create_service()
+    app = Flask(__name__)
+    api = Api(app)
+    api.add_resource(
+        Availability, "/availability", resource_class_kwargs={"service": service}
+    )
+    if service.metrics is not None:
+        app.add_url_rule(
+            "/metrics",
+            "metrics",
+            lambda: (service.metrics.render(), 200, {"Content-Type": "text/plain"}),
+        )
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1", help="Host to listen on")
+    parser.add_argument("--port", type=int, default=5000, help="Port to listen on")
+    parser.add_argument(
+        "-c",
+        "--cache",
+        default=":memory:",
+        help="SQLite file to cache API responses in",
+    )
+    parser.add_argument(
+        "-s",
+        "--store",
+        help="Calendar store to answer Huisvuilkalendar lookups from (see calendar_store.py)",
+    )
+    parser.add_argument(
+        "-m",
+        "--municipalities",
+        help="JSON file with the municipalities and their calendar APIs (default Den Haag)",
+    )
+    args = parser.parse_args()
+
+    service = create_service(
+        cache_path=args.cache,
+        store_path=args.store,
+        municipalities_path=args.municipalities,
+    )
+    service.warm_up()
+    create_app(service).run(host=args.host, port=args.port, threaded=True)
@@ -0,0 +1,50 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    # Concurrent calls with the same key share a single execution of fn and its result.
+    # Once that execution finishes the key is forgotten, so later calls run fn again.
+    # The result object is shared between callers, who must not mutate it.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn, *args):
+        with self._lock:
+            future = self._calls.get(key)
+            owner = future is None
+            if owner:
+                future = self._calls[key] = Future()
+        if owner:
+            try:
+                result = fn(*args)
+            except Exception as error:
+                self._forget(key)
+                future.set_exception(error)
+            else:
+                self._forget(key)
+                future.set_result(result)
+        return future.result()
+
+    def _forget(self, key):
+        with self._lock:
+            del self._calls[key]
+
+
+class AsyncSingleFlight:
+    # asyncio version of SingleFlight: concurrent awaits of the same key share one task.
+
+    def __init__(self):
+        self._calls = {}
+
+    async def do(self, key, fn, *args):
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn(*args))
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        # A cancelled caller must not cancel the call the other callers are waiting for.
+        return await asyncio.shield(task)
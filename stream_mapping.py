@@ -0,0 +1,73 @@
+import bisect
+import json
+from models import SeenonsStream, HagueStream, from_payloads
+
+
+class StreamMapping:
+    # Index translating Huisvuilkalendar stream titles to Seenons stream product IDs.
+    # A title matches every Seenons stream whose type starts with it (case insensitive). As in
+    # the original scan over the catalogue the last match wins, and 0 means there is no match.
+    # Build it once from the Seenons catalogue and reuse it for every address.
+
+    def __init__(self, streams):
+        # Seenons (type, stream_product_id) pairs in catalogue order.
+        self.streams = [(stream_type, stream_id) for stream_type, stream_id in streams]
+        # Lowercase types sorted alphabetically, with their catalogue position.
+        index = sorted(
+            (stream_type.lower(), position)
+            for position, (stream_type, _) in enumerate(self.streams)
+        )
+        self._types = [stream_type for stream_type, _ in index]
+        self._positions = [position for _, position in index]
+        self._translations = {}
+
+    @classmethod
+    def from_seenons_streams(cls, all_seenons_waste_streams):
+        return cls.from_items(all_seenons_waste_streams["items"])
+
+    @classmethod
+    def from_items(cls, items):
+        # Build from (an iterable of) Seenons catalogue items, e.g. SeenonsAPI.iter_all_waste_streams(),
+        # or SeenonsStreams.
+        return cls(
+            (stream.type, stream.id) for stream in from_payloads(SeenonsStream, items)
+        )
+
+    def translate(self, title):
+        # Seenons stream product ID for a Huisvuilkalendar stream title, 0 if unknown.
+        title = title.lower()
+        if title not in self._translations:
+            # Types starting with the title are a contiguous range of the sorted index.
+            position = -1
+            i = bisect.bisect_left(self._types, title)
+            while i < len(self._types) and self._types[i].startswith(title):
+                position = max(position, self._positions[i])
+                i += 1
+            self._translations[title] = (
+                self.streams[position][1] if position >= 0 else 0
+            )
+        return self._translations[title]
+
+    def id_map(self, hague_waste_streams):
+        # Map Huisvuilkalendar stream IDs (of 'afvalstromen' payloads or HagueStreams) to
+        # Seenons stream product IDs.
+        return {
+            stream.id: self.translate(stream.title)
+            for stream in from_payloads(HagueStream, hague_waste_streams)
+        }
+
+    def to_dict(self):
+        return {"streams": [list(stream) for stream in self.streams]}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["streams"])
+
+    def save(self, path):
+        with open(path, "w") as mapping_file:
+            json.dump(self.to_dict(), mapping_file)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as mapping_file:
+            return cls.from_dict(json.load(mapping_file))
@@ -0,0 +1,149 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from datetime import date
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+BAG_IDS = ["0518200001769844", "0518200001769845"]
+
+
+def load_fixture(name):
+    # Load a recorded API response from the fixtures directory.
+    with open(os.path.join(FIXTURES, name)) as fixture:
+        return json.load(fixture)
+
+
+def fixture_routes(year=None):
+    # Map request paths of the Seenons and Huisvuilkalendar APIs to the recorded responses.
+    # The recorded calendar is served for the given year, the current one by default.
+    year = year if year is not None else date.today().year
+    routes = {
+        "/api/me/streams": load_fixture("seenons_streams.json"),
+        "/api/me/streams?postal_code=2512HE": load_fixture(
+            "seenons_streams_2512HE.json"
+        ),
+        "/adressen/2512HE:68": load_fixture("adressen_2512HE_68.json"),
+        "/adressen/2512HE:34": [],
+    }
+    for bag_id in BAG_IDS:
+        routes[f"/rest/adressen/{bag_id}/afvalstromen"] = load_fixture(
+            "afvalstromen.json"
+        )
+        routes[f"/rest/adressen/{bag_id}/kalender/{year}"] = load_fixture(
+            "kalender.json"
+        )
+    return routes
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # Request handler of a StubServer, subclassed per server with its `stub` set.
+    stub = None
+
+    # HTTP/1.1 so clients can keep connections alive, without Nagle delaying
+    # the body written after the headers.
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def handle_one_request(self):
+        # Clients may give up (e.g. time out) before the response is written.
+        try:
+            super().handle_one_request()
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+    def do_GET(self):
+        fault = self.stub.record(self.path)
+        if self.stub.delay:
+            time.sleep(self.stub.delay)
+        if fault is not None:
+            self.send_fault(fault)
+            return
+        if self.path in self.stub.routes:
+            status, body = 200, json.dumps(self.stub.routes[self.path]).encode()
+        else:
+            status, body = 404, b'{"error": "not found"}'
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()
+        # Support revalidation of cached responses.
+        if status == 200 and self.headers.get("If-None-Match") == etag:
+            status, body = 304, b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_fault(self, status):
+        body = b'{"error": "injected fault"}'
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if self.stub.retry_after is not None:
+            self.send_header("Retry-After", str(self.stub.retry_after))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer:
+    # Local HTTP server replaying canned JSON responses, with optional latency per request.
+    # Serves both APIs: use `seenons_url` and `hague_url` as base URLs of the API clients.
+    # Faults can be injected: `faults` are status codes answered (in order) to the next
+    # requests instead of their response, with a Retry-After header if `retry_after` is set,
+    # and while `down` is set every request is answered with 503.
+
+    def __init__(self, routes=None, delay=0.0, faults=()):
+        self.routes = routes if routes is not None else fixture_routes()
+        self.delay = delay
+        self.faults = deque(faults)
+        self.retry_after = None
+        self.down = False
+        self.requests = []
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    @property
+    def seenons_url(self):
+        return f"{self.url}/api/me/streams"
+
+    @property
+    def hague_url(self):
+        return self.url
+
+    def record(self, path):
+        # Log the requested path. Returns the status code of the fault to answer it with, if any.
+        with self._lock:
+            self.requests.append(path)
+            if self.faults:
+                return self.faults.popleft()
+        return 503 if self.down else None
+
+    def _handler(self):
+        return type("Handler", (StubHandler,), {"stub": self})
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -1,4 +1,49 @@
+import asyncio
+import contextlib
+import copy
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
+import requests
+from datetime import date
+from urllib.parse import urlsplit
+from unittest import mock
+from integration_API import SeenonsAPI, HagueAPI, Integration, AddressNotFoundError
+from resolver import AddressResolver
+from batch import read_addresses, resolve_batch, resolve_batch_parallel
+from change_feed import SnapshotStore, diff_dates, iter_changes
+from municipalities import MunicipalityRouter, UnknownMunicipalityError
+from stub_server import StubServer, fixture_routes, load_fixture
+from response_cache import ResponseCache
+from stream_mapping import StreamMapping
+from calendar_array import CalendarArray
+from availability_index import AvailabilityIndex
+from schedule import Schedule
+from models import Address, CollectionDate, HagueStream, SeenonsStream
+from service import AvailabilityService, create_app
+from calendar_store import (
+    CalendarStore,
+    NotInStoreError,
+    OfflineHagueAPI,
+    import_calendars,
+)
+from benchmark import run, find_regressions, synthetic_routes
+from instrumentation import Instrumentation, MetricsSink, Sink
+import integration_cli
+from json_stream import iter_items
+from transport import Transport, TokenBucket, CircuitOpenError
+from integration_async import (
+    AsyncSeenonsAPI,
+    AsyncHagueAPI,
+    create_session,
+    get_available_streams,
+)
 from integration_cli import (
     get_bagid,
     get_house_info,
@@ -9,6 +54,45 @@ from integration_cli import (
 )
 
 
+class FakeSeenonsAPI(SeenonsAPI):
+    # Seenons API answering from fixtures and counting calls per method.
+    def __init__(self):
+        super().__init__()
+        self.calls = {"all": 0, "postcode": 0}
+        self.lock = threading.Lock()
+
+    def get_all_waste_streams(self):
+        with self.lock:
+            self.calls["all"] += 1
+        return load_fixture("seenons_streams.json")
+
+    def get_waste_streams_per_postcode(self, post_code):
+        with self.lock:
+            self.calls["postcode"] += 1
+        return load_fixture("seenons_streams_2512HE.json")
+
+
+class FakeHagueAPI(HagueAPI):
+    # Huisvuilkalendar API answering from fixtures and counting address lookups.
+    def __init__(self):
+        super().__init__()
+        self.address_calls = 0
+        self.lock = threading.Lock()
+
+    def get_addresses(self, post_code, house_number):
+        with self.lock:
+            self.address_calls += 1
+        if house_number == "34":
+            return []
+        return load_fixture("adressen_2512HE_68.json")
+
+    def get_waste_streams(self, bag_id):
+        return load_fixture("afvalstromen.json")
+
+    def get_dates_per_stream(self, bag_id, year=None):
+        return load_fixture("kalender.json")
+
+
 class TestIntegration(unittest.TestCase):
     def test_1(self):
         # Test bag ID for correct address
@@ -101,14 +185,1059 @@ class TestIntegration(unittest.TestCase):
         print("test 8 completed")
 
 
+class TestBatch(unittest.TestCase):
+    def test_shared_lookups_fetched_once(self):
+        # 40 addresses over 2 post codes and 2 house numbers
+        seenons_api = FakeSeenonsAPI()
+        hague_api = FakeHagueAPI()
+        resolver = AddressResolver(seenons_api, hague_api)
+        addresses = [
+            {
+                "postcode": f"25{12 + i % 2}HE",
+                "housenumber": "68" if i % 4 < 2 else "70",
+                "houseletter": "A",
+            }
+            for i in range(40)
+        ]
+        records = list(resolve_batch(resolver, addresses, workers=8))
+        self.assertEqual(len(records), 40)
+        self.assertEqual(seenons_api.calls, {"all": 1, "postcode": 2})
+        self.assertEqual(hague_api.address_calls, 4)
+        # Records come back in input order
+        self.assertEqual(
+            [r["postcode"] for r in records], [a["postcode"] for a in addresses]
+        )
+        self.assertEqual(records[0]["bagid"], "0518200001769844")
+        self.assertEqual([s["id"] for s in records[0]["streams"]], [17, 3, 1])
+
+    def test_unknown_address_and_letter(self):
+        resolver = AddressResolver(FakeSeenonsAPI(), FakeHagueAPI())
+        addresses = [
+            {"postcode": "2512HE", "housenumber": "34", "houseletter": None},
+            {"postcode": "2512HE", "housenumber": "68", "houseletter": "Z"},
+            {"postcode": "2512HE", "housenumber": "68", "houseletter": None},
+        ]
+        records = list(resolve_batch(resolver, addresses, workers=2))
+        self.assertEqual(records[0]["error"], "Postal address does not exist")
+        self.assertEqual(records[1]["error"], "House letter does not exist")
+        self.assertEqual(records[2]["error"], 'House letter required, one of "A", "B"')
+
+    def test_empty_house_letter_selects_address_without_letter(self):
+        class LetterlessHagueAPI(FakeHagueAPI):
+            def get_addresses(self, post_code, house_number):
+                addresses = load_fixture("adressen_2512HE_68.json")
+                addresses[0]["huisletter"] = ""
+                return addresses
+
+        resolver = AddressResolver(FakeSeenonsAPI(), LetterlessHagueAPI())
+        with tempfile.TemporaryDirectory() as directory:
+            csv_path = os.path.join(directory, "addresses.csv")
+            with open(csv_path, "w") as csv_file:
+                csv_file.write("postcode,housenumber,houseletter\n2512HE,66,\n")
+            jsonl_path = os.path.join(directory, "addresses.jsonl")
+            with open(jsonl_path, "w") as jsonl_file:
+                for letter in ["", None]:
+                    row = {
+                        "postcode": "2512HE",
+                        "housenumber": 66,
+                        "houseletter": letter,
+                    }
+                    jsonl_file.write(json.dumps(row) + "\n")
+            addresses = [*read_addresses(csv_path), *read_addresses(jsonl_path)]
+        self.assertEqual([a["houseletter"] for a in addresses], ["", "", None])
+        records = list(resolve_batch(resolver, addresses, workers=2))
+        self.assertEqual(records[0]["bagid"], "0518200001769844")
+        self.assertEqual(records[1]["bagid"], "0518200001769844")
+        self.assertEqual(records[2]["error"], 'House letter required, one of "", "B"')
+
+    def test_parallel_integration_matches_threads(self):
+        resolver = AddressResolver(FakeSeenonsAPI(), FakeHagueAPI())
+        addresses = [
+            {
+                "postcode": "2512HE",
+                "housenumber": ["68", "34"][i % 5 == 0],
+                "houseletter": "AB"[i % 2],
+            }
+            for i in range(150)
+        ]
+        expected = list(resolve_batch(resolver, addresses, ["Tuesday"], workers=4))
+        records = list(
+            resolve_batch_parallel(resolver, addresses, ["Tuesday"], 4, processes=2)
+        )
+        self.assertEqual(records, expected)
+        self.assertEqual(records[1]["bagid"], "0518200001769845")
+        self.assertEqual(records[0]["error"], "Postal address does not exist")
+
+
+class TestChangeFeed(unittest.TestCase):
+    def test_diff_dates(self):
+        added, removed, moved = diff_dates(
+            ["2022-12-20", "2022-12-27", "2023-01-03"],
+            ["2022-12-21", "2022-12-27", "2023-01-20"],
+        )
+        self.assertEqual(added, ["2023-01-20"])
+        self.assertEqual(removed, ["2023-01-03"])
+        self.assertEqual(moved, [{"from": "2022-12-20", "to": "2022-12-21"}])
+
+    def test_only_changed_addresses_emitted(self):
+        class ChangingHagueAPI(FakeHagueAPI):
+            # Moves Restafval of 2022-12-20 to the next day and cancels GFT of 2022-12-19.
+            changed = False
+
+            def get_dates_per_stream(self, bag_id, year=None):
+                hague_dates = super().get_dates_per_stream(bag_id, year)
+                if not self.changed:
+                    return hague_dates
+                moved = {(4, "2022-12-20"): "2022-12-21"}
+                cancelled = (1, "2022-12-19")
+                hague_dates = [
+                    entry
+                    for entry in hague_dates
+                    if (entry["afvalstroom_id"], entry["ophaaldatum"]) != cancelled
+                ]
+                for entry in hague_dates:
+                    key = (entry["afvalstroom_id"], entry["ophaaldatum"])
+                    entry["ophaaldatum"] = moved.get(key, entry["ophaaldatum"])
+                return hague_dates
+
+        hague_api = ChangingHagueAPI()
+        addresses = [
+            {"postcode": "2512HE", "housenumber": "68", "houseletter": letter}
+            for letter in ["A", "B", "Z"]
+        ]
+        with tempfile.TemporaryDirectory() as directory:
+            snapshots = SnapshotStore(os.path.join(directory, "snapshots.sqlite"))
+
+            def run():
+                resolver = AddressResolver(FakeSeenonsAPI(), hague_api)
+                return list(
+                    iter_changes(
+                        resolver, snapshots, addresses, 4, 2, today=date(2022, 12, 1)
+                    )
+                )
+
+            self.assertEqual(run(), [])
+            hague_api.changed = True
+            deltas = run()
+            self.assertEqual(run(), [])
+            snapshots.close()
+        self.assertEqual(
+            [delta["bagid"] for delta in deltas],
+            ["0518200001769844", "0518200001769845"],
+        )
+        self.assertEqual(
+            deltas[0]["streams"],
+            [
+                {
+                    "id": 17,
+                    "type": "gft-afval",
+                    "added": [],
+                    "removed": ["2022-12-19"],
+                    "moved": [],
+                },
+                {
+                    "id": 3,
+                    "type": "restafval",
+                    "added": [],
+                    "removed": [],
+                    "moved": [{"from": "2022-12-20", "to": "2022-12-21"}],
+                },
+            ],
+        )
+
+
+class TestMunicipalities(unittest.TestCase):
+    def test_routed_by_postcode_and_bag_id(self):
+        year = date.today().year
+        bag_id = "0546100000000001"
+        routes = fixture_routes(year)
+        routes["/api/me/streams?postal_code=2311AB"] = routes[
+            "/api/me/streams?postal_code=2512HE"
+        ]
+        leiden_routes = {
+            "/adressen/2311AB:1": [
+                {
+                    "bagid": bag_id,
+                    "postcode": "2311AB",
+                    "huisnummer": 1,
+                    "huisletter": "",
+                }
+            ],
+            f"/rest/adressen/{bag_id}/afvalstromen": load_fixture("afvalstromen.json"),
+            f"/rest/adressen/{bag_id}/kalender/{year}": load_fixture("kalender.json"),
+        }
+        with StubServer(routes) as hague, StubServer(leiden_routes) as leiden:
+            router = MunicipalityRouter()
+            router.add("Den Haag", "0518", [[2491, 2599]], hague.hague_url)
+            router.add("Leiden", "0546", [[2300, 2334]], leiden.hague_url)
+            resolver = AddressResolver(SeenonsAPI(base_url=hague.seenons_url), router)
+            addresses = [
+                {"postcode": "2512HE", "housenumber": "68", "houseletter": "A"},
+                {"postcode": "2311AB", "housenumber": "1", "houseletter": None},
+                {"postcode": "1012AB", "housenumber": "1", "houseletter": None},
+            ]
+            records = list(resolve_batch(resolver, addresses, workers=2))
+        self.assertEqual(records[0]["bagid"], "0518200001769844")
+        self.assertEqual(records[1]["bagid"], bag_id)
+        self.assertEqual(records[1]["streams"], records[0]["streams"])
+        self.assertTrue(records[2]["error"].startswith("UnknownMunicipalityError"))
+        self.assertEqual(
+            sorted(leiden.requests),
+            sorted(["/adressen/2311AB:1", *list(leiden_routes)[1:]]),
+        )
+        self.assertNotIn("/adressen/2311AB:1", hague.requests)
+        # Backends share the transport and parsed documents: both calendars parsed once
+        den_haag, leiden_api = router.backends["0518"], router.backends["0546"]
+        self.assertIs(den_haag.transport, leiden_api.transport)
+        self.assertIs(leiden_api.documents, router.documents)
+        self.assertEqual(len(router.documents), 4)
+        self.assertEqual(router.municipality("2333 CC"), "Leiden")
+        with self.assertRaises(UnknownMunicipalityError):
+            router.get_waste_streams("0363000000000001")
+        with self.assertRaises(ValueError):
+            router.add("Leiden-Noord", "0547", [[2334, 2340]], leiden.hague_url)
+
+
+class TestResolver(unittest.TestCase):
+    def test_every_house_letter(self):
+        resolver = AddressResolver(FakeSeenonsAPI(), FakeHagueAPI())
+        records = resolver.resolve_all("2512HE", "68", ["Tuesday"])
+        self.assertEqual([r["houseletter"] for r in records], ["A", "B"])
+        self.assertEqual(
+            [r["bagid"] for r in records], ["0518200001769844", "0518200001769845"]
+        )
+        with self.assertRaises(AddressNotFoundError):
+            resolver.resolve_all("2512HE", "34")
+        with self.assertRaises(AddressNotFoundError):
+            FakeHagueAPI().get_house_info("2512HE", "34")
+
+    def test_interactive_dependencies_imported_lazily(self):
+        code = "import sys, user_interface, integration_cli; print('inquirer' in sys.modules)"
+        output = subprocess.run(
+            [sys.executable, "-c", code],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout
+        self.assertEqual(output.strip(), "False")
+
+
+class TestAsync(unittest.TestCase):
+    def test_concurrent_fetch_against_stub(self):
+        delay = 0.1
+        bag_id = "0518200001769844"
+        with StubServer(delay=delay) as stub:
+            # Sequential baseline with the blocking clients
+            started = time.perf_counter()
+            expected = Integration().get_available_streams(
+                HagueAPI(base_url=stub.hague_url).get_waste_streams(bag_id),
+                SeenonsAPI(base_url=stub.seenons_url).get_all_waste_streams(),
+                HagueAPI(base_url=stub.hague_url).get_dates_per_stream(bag_id),
+                [17, 1, 3],
+            )
+            sequential = time.perf_counter() - started
+
+            async def fetch():
+                async with create_session(limit_per_host=4) as session:
+                    started = time.perf_counter()
+                    result = await get_available_streams(
+                        AsyncSeenonsAPI(session, stub.seenons_url),
+                        AsyncHagueAPI(session, stub.hague_url),
+                        "2512HE",
+                        bag_id,
+                    )
+                    return result, time.perf_counter() - started
+
+            result, concurrent = asyncio.run(fetch())
+        self.assertEqual(result, expected)
+        self.assertGreaterEqual(sequential, 3 * delay)
+        # Four requests overlap, so the address takes about one round-trip
+        self.assertLess(concurrent, 2 * delay)
+
+
+class TestResponseCache(unittest.TestCase):
+    def test_repeat_lookup_served_from_cache(self):
+        bag_id = "0518200001769844"
+        with StubServer() as stub:
+            hague_api = HagueAPI(base_url=stub.hague_url, cache=ResponseCache())
+            dates = hague_api.get_dates_per_stream(bag_id)
+            started = time.perf_counter()
+            for _ in range(100):
+                self.assertEqual(hague_api.get_dates_per_stream(bag_id), dates)
+            elapsed = (time.perf_counter() - started) / 100
+        self.assertEqual(len(stub.requests), 1)
+        self.assertLess(elapsed, 0.001)
+
+    def test_expired_entry_revalidated(self):
+        cache = ResponseCache(ttls={"seenons_postcode_streams": 0})
+        with StubServer() as stub:
+            seenons_api = SeenonsAPI(base_url=stub.seenons_url, cache=cache)
+            first = seenons_api.get_waste_streams_per_postcode("2512HE")
+            second = seenons_api.get_waste_streams_per_postcode("2512HE")
+        # Second request was a conditional one answered with 304
+        self.assertEqual(len(stub.requests), 2)
+        self.assertEqual(first, second)
+
+    def test_lru_eviction(self):
+        cache = ResponseCache(max_bytes=10)
+        cache.put("a", "12345", "hague_kalender")
+        cache.put("b", "23456", "hague_kalender")
+        cache.get("a")
+        cache.put("c", "34567", "hague_kalender")
+        # b was least recently used
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("a"))
+        self.assertIsNotNone(cache.get("c"))
+
+
+class TestContentDedup(unittest.TestCase):
+    def test_identical_bodies_stored_once(self):
+        cache = ResponseCache(max_bytes=10)
+        cache.put("a", "12345", "hague_kalender")
+        cache.put("b", "12345", "hague_kalender")
+        self.assertEqual(cache.get("b").body, "12345")
+        # Replacing the body of a drops the old one only when b no longer refers to it
+        cache.put("a", "67890", "hague_kalender")
+        self.assertEqual(cache.get("b").body, "12345")
+        cache.put("b", "67890", "hague_kalender")
+        self.assertEqual(cache._size, 5)
+
+    def test_calendar_integrated_once(self):
+        # Every address of the street has its own bag ID but the same calendar
+        routes, addresses = synthetic_routes(20)
+        stages = []
+
+        class StageSink(Sink):
+            def record_stage(self, stage, seconds):
+                stages.append(stage)
+
+        with StubServer(routes) as stub:
+            hague_api = HagueAPI(base_url=stub.hague_url)
+            resolver = AddressResolver(
+                SeenonsAPI(base_url=stub.seenons_url),
+                hague_api,
+                Integration(Instrumentation([StageSink()])),
+            )
+            records = list(resolve_batch(resolver, addresses, workers=4))
+        self.assertEqual(len({record["bagid"] for record in records}), 20)
+        self.assertEqual(stages.count("create_calendar_array"), 1)
+        # 20 address lists, but one 'afvalstromen' and one calendar document
+        self.assertEqual(len(hague_api.documents), 22)
+        self.assertEqual(records[0]["streams"], records[19]["streams"])
+
+
+class TestStreamMapping(unittest.TestCase):
+    def test_translate(self):
+        mapping = StreamMapping.from_seenons_streams(
+            load_fixture("seenons_streams.json")
+        )
+        id_map = mapping.id_map(load_fixture("afvalstromen.json"))
+        # gft -> 17, pmd -> 1, papier -> 4, rest -> 3, kerstbomen is unknown, hence 0
+        self.assertEqual(id_map, {1: 17, 2: 1, 3: 4, 4: 3, 5: 0})
+        # Like the original scan, the last matching Seenons stream wins
+        mapping = StreamMapping([("papier-klein", 7), ("Papier-groot", 8), ("pmd", 1)])
+        self.assertEqual(mapping.translate("PAPIER"), 8)
+
+    def test_inputs_not_mutated(self):
+        hague_streams = load_fixture("afvalstromen.json")
+        hague_dates = load_fixture("kalender.json")
+        dates = Integration().modify_hague_stream_dates(
+            hague_streams, load_fixture("seenons_streams.json"), hague_dates
+        )
+        self.assertEqual(hague_streams, load_fixture("afvalstromen.json"))
+        self.assertEqual(hague_dates, load_fixture("kalender.json"))
+        self.assertEqual(dates[0], CollectionDate(17, "2022-01-03"))
+
+    def test_save_and_load(self):
+        mapping = StreamMapping.from_seenons_streams(
+            load_fixture("seenons_streams.json")
+        )
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "mapping.json")
+            mapping.save(path)
+            loaded = StreamMapping.load(path)
+        self.assertEqual(loaded.streams, mapping.streams)
+        self.assertEqual(loaded.translate("Restafval"), 3)
+
+
+class TestModels(unittest.TestCase):
+    def test_from_payload(self):
+        address = Address.from_payload(load_fixture("adressen_2512HE_68.json")[1])
+        self.assertEqual(address, Address("0518200001769845", "2512HE", 68, "B"))
+        stream = SeenonsStream.from_payload(
+            load_fixture("seenons_streams_2512HE.json")["items"][0]
+        )
+        self.assertEqual(stream, SeenonsStream(17, "gft-afval"))
+        self.assertEqual(
+            HagueStream.from_payload(load_fixture("afvalstromen.json")[3]),
+            HagueStream(4, "Restafval"),
+        )
+        collection_date = CollectionDate.from_payload(load_fixture("kalender.json")[0])
+        self.assertIsNone(collection_date.weekday)
+        (collection_date,) = Integration().add_weekday_to_hague_dates([collection_date])
+        self.assertEqual(collection_date.weekday, "Monday")
+        self.assertEqual(collection_date.to_payload()["weekday"], "Monday")
+        self.assertFalse(hasattr(collection_date, "__dict__"))
+        with self.assertRaises(AttributeError):
+            collection_date.stream_id = 4
+
+    def test_pipeline_on_models(self):
+        integration = Integration()
+        args = (
+            load_fixture("afvalstromen.json"),
+            load_fixture("seenons_streams.json"),
+            load_fixture("kalender.json"),
+        )
+        expected = integration.get_available_streams(*args, [17, 3], ["Tuesday"])
+        models = (
+            [HagueStream.from_payload(stream) for stream in args[0]],
+            args[1],
+            [CollectionDate.from_payload(item) for item in args[2]],
+        )
+        self.assertEqual(
+            integration.get_available_streams(*models, [17, 3], ["Tuesday"]), expected
+        )
+        hague_dates = integration.filter_dates_by_weekday(
+            integration.add_weekday_to_hague_dates(
+                integration.modify_hague_stream_dates(*models)
+            ),
+            ["Tuesday"],
+        )
+        self.assertEqual(
+            integration.create_availability_dict(hague_dates, [17, 3]), expected
+        )
+        self.assertEqual(
+            integration.translate_hague_to_seenons_id(args[1], models[0])[0],
+            HagueStream(17, "GFT"),
+        )
+        # The resolver keeps the models of its shared lookups, not the payloads
+        resolver = AddressResolver(FakeSeenonsAPI(), FakeHagueAPI())
+        resolver.resolve("2512HE", "68", "A")
+        self.assertIsInstance(resolver.get_addresses("2512HE", "68")[0], Address)
+        self.assertEqual(
+            resolver.get_waste_streams_per_postcode("2512HE")[0],
+            SeenonsStream(17, "gft-afval"),
+        )
+
+
+class TestCalendarArray(unittest.TestCase):
+    def test_weekdays_match_strftime(self):
+        integration = Integration()
+        hague_dates = load_fixture("kalender.json")
+        calendar = CalendarArray.from_hague_dates(hague_dates)
+        expected = [
+            integration.translate_date_to_weekday(d["ophaaldatum"]) for d in hague_dates
+        ]
+        self.assertEqual(calendar.weekday_names().tolist(), expected)
+        self.assertEqual(
+            calendar.date_strings().tolist(), [d["ophaaldatum"] for d in hague_dates]
+        )
+
+    def test_same_availability_as_list_pipeline(self):
+        integration = Integration()
+        args = (
+            load_fixture("afvalstromen.json"),
+            load_fixture("seenons_streams.json"),
+            load_fixture("kalender.json"),
+        )
+        seenons_stream_ids = [17, 1, 3]
+        hague_dates = integration.add_weekday_to_hague_dates(
+            integration.modify_hague_stream_dates(*args)
+        )
+        hague_dates = integration.filter_dates_by_weekday(
+            hague_dates, ["tuesday", "Monday", "Caturday"]
+        )
+        expected = integration.create_availability_dict(hague_dates, seenons_stream_ids)
+        calendar = integration.create_calendar_array(*args).filter_weekdays(
+            ["tuesday", "Monday", "Caturday"]
+        )
+        self.assertEqual(
+            integration.create_availability_dict(calendar, seenons_stream_ids), expected
+        )
+        self.assertEqual(list(expected), [17, 3])
+
+
+class TestDateRange(unittest.TestCase):
+    def test_only_years_in_range_fetched(self):
+        bag_id = "0518200001769844"
+        routes = {
+            f"/rest/adressen/{bag_id}/kalender/2022": load_fixture("kalender.json"),
+            f"/rest/adressen/{bag_id}/kalender/2023": [
+                {"afvalstroom_id": 4, "ophaaldatum": "2023-01-03"},
+                {"afvalstroom_id": 4, "ophaaldatum": "2023-01-10"},
+            ],
+        }
+        with StubServer(routes) as stub:
+            hague_api = HagueAPI(base_url=stub.hague_url, cache=ResponseCache())
+            hague_dates = hague_api.get_dates_in_range(
+                bag_id, date(2022, 12, 21), date(2023, 1, 9)
+            )
+            hague_api.get_dates_in_range(bag_id, date(2023, 1, 1), date(2023, 1, 9))
+        self.assertEqual(
+            [hague_date["ophaaldatum"] for hague_date in hague_dates],
+            ["2022-12-22", "2022-12-28", "2023-01-03"],
+        )
+        # Each year is fetched once and cached separately
+        self.assertEqual(
+            stub.requests,
+            [
+                f"/rest/adressen/{bag_id}/kalender/2022",
+                f"/rest/adressen/{bag_id}/kalender/2023",
+            ],
+        )
+
+    def test_current_year_refreshed_more_often(self):
+        hague_api = HagueAPI()
+        cache = ResponseCache()
+        year = date.today().year
+        ttls = [cache.ttl(hague_api.calendar_endpoint(year + i)) for i in (-1, 0, 1)]
+        self.assertGreater(ttls[0], ttls[2])
+        self.assertGreater(ttls[2], ttls[1])
+
+
+class TestAvailabilityIndex(unittest.TestCase):
+    def setUp(self):
+        integration = Integration()
+        calendar = integration.create_calendar_array(
+            load_fixture("afvalstromen.json"),
+            load_fixture("seenons_streams.json"),
+            load_fixture("kalender.json"),
+        )
+        self.index = integration.create_availability_index(calendar, [17, 1, 3])
+
+    def test_dates_per_stream(self):
+        hague_dates = [
+            {"afvalstroom_id": 17, "ophaaldatum": "2022-01-03"},
+            {"afvalstroom_id": 3, "ophaaldatum": "2022-01-04"},
+            {"afvalstroom_id": 17, "ophaaldatum": "2022-01-17"},
+        ]
+        expected = {17: ["2022-01-03", "2022-01-17"], 3: ["2022-01-04"]}
+        integration = Integration()
+        self.assertEqual(
+            integration.create_availability_dict(hague_dates, [17, 3]), expected
+        )
+        calendar = CalendarArray.from_hague_dates(hague_dates)
+        self.assertEqual(
+            integration.create_availability_dict(calendar, [17, 3]), expected
+        )
+        # Restafval (3) is collected on Tuesdays, GFT (17) every other Monday
+        available = self.index.to_availability_dict()
+        self.assertEqual(len(available[3]), 52)
+        self.assertEqual(len(available[17]), 26)
+
+    def test_queries(self):
+        index = self.index
+        self.assertEqual(index.next_pickup(3, date(2022, 12, 21)), "2022-12-28")
+        self.assertEqual(index.next_pickup(3, "2022-12-20"), "2022-12-20")
+        self.assertIsNone(index.next_pickup(3, date(2022, 12, 29)))
+        self.assertIsNone(index.next_pickup(99, date(2022, 1, 1)))
+        self.assertEqual(
+            index.pickups_in_range(17, date(2022, 1, 1), date(2022, 1, 31)),
+            ["2022-01-03", "2022-01-17", "2022-01-31"],
+        )
+        self.assertEqual(index.pickups_on_weekdays(3, ["wednesday"]), ["2022-12-28"])
+        self.assertEqual(
+            index.pickups_on_weekdays(
+                3, ["Tuesday", "Wednesday"], date(2022, 12, 15), date(2022, 12, 31)
+            ),
+            ["2022-12-20", "2022-12-28"],
+        )
+        self.assertEqual(index.pickups_on_weekdays(17, ["Friday"]), [])
+
+    def test_serialization(self):
+        data = json.loads(json.dumps(self.index.to_dict()))
+        index = AvailabilityIndex.from_dict(data)
+        self.assertEqual(
+            index.to_availability_dict(), self.index.to_availability_dict()
+        )
+        self.assertEqual(index.next_pickup(1, "2022-06-01"), "2022-06-09")
+
+
+class TestSchedule(unittest.TestCase):
+    def test_recurrence_rules(self):
+        integration = Integration()
+        schedules = integration.create_schedules(
+            load_fixture("afvalstromen.json"),
+            load_fixture("seenons_streams.json"),
+            load_fixture("kalender.json"),
+        )
+        restafval = schedules[3]
+        self.assertEqual((restafval.weekday, restafval.interval_weeks), ("Tuesday", 1))
+        self.assertEqual(restafval.missing, ["2022-12-27"])
+        self.assertEqual(restafval.extra, ["2022-12-28"])
+        self.assertEqual(schedules[17].describe(), "every other Monday")
+        self.assertEqual(schedules[4].describe(), "every 4 weeks on Friday")
+        # Kerstbomen has no Seenons stream and a single date
+        self.assertEqual(schedules[0].describe(), "on 2022-01-09")
+        # Schedules expand back to the same dates
+        calendar = integration.create_calendar_array(
+            load_fixture("afvalstromen.json"),
+            load_fixture("seenons_streams.json"),
+            load_fixture("kalender.json"),
+        )
+        available = integration.create_availability_dict(calendar, list(schedules))
+        for stream_id, schedule in schedules.items():
+            schedule = Schedule.from_dict(json.loads(json.dumps(schedule.to_dict())))
+            self.assertEqual(schedule.dates(), available[stream_id])
+
+    def test_summary_cached_per_bag_id(self):
+        stages = []
+
+        class StageSink(Sink):
+            def record_stage(self, stage, seconds):
+                stages.append(stage)
+
+        integration = Integration(Instrumentation([StageSink()]))
+        resolver = AddressResolver(FakeSeenonsAPI(), FakeHagueAPI(), integration)
+        for _ in range(3):
+            record = resolver.summarise("2512HE", "68", "A")
+        self.assertEqual(stages.count("create_schedules"), 1)
+        self.assertEqual([s["id"] for s in record["streams"]], [17, 3, 1])
+        self.assertEqual(
+            record["streams"][0]["schedule"]["description"], "every other Monday"
+        )
+
+
+class TestTransport(unittest.TestCase):
+    def test_retries_server_errors(self):
+        metrics = MetricsSink()
+        with StubServer(faults=[503, 502]) as stub:
+            hague_api = HagueAPI(
+                Transport(backoff=0.01),
+                stub.hague_url,
+                instrumentation=Instrumentation([metrics]),
+            )
+            waste_streams = hague_api.get_waste_streams("0518200001769844")
+        self.assertEqual(waste_streams, load_fixture("afvalstromen.json"))
+        self.assertEqual(len(stub.requests), 3)
+        self.assertIn(
+            'upstream_retries_total{endpoint="hague_afvalstromen"} 2', metrics.render()
+        )
+
+    def test_honours_retry_after(self):
+        sleeps = []
+        with StubServer(faults=[429]) as stub:
+            stub.retry_after = 2
+            transport = Transport(sleep=sleeps.append)
+            response = transport.get(stub.seenons_url)
+            self.assertEqual(response.status_code, 200)
+            # Retries exhausted: the last error response is raised
+            stub.faults.extend([500] * 4)
+            with self.assertRaises(requests.HTTPError):
+                transport.get(stub.seenons_url)
+        self.assertEqual(sleeps, [2.0] * 4)
+
+    def test_timeout(self):
+        with StubServer(delay=0.5) as stub:
+            transport = Transport(timeout=0.05, retries=0)
+            with self.assertRaises(requests.Timeout):
+                transport.get(stub.seenons_url)
+
+    def test_circuit_open_serves_stale_cache(self):
+        cache = ResponseCache(ttls={"seenons_streams": 0})
+        with StubServer() as stub:
+            transport = Transport(retries=0, failure_threshold=2)
+            seenons_api = SeenonsAPI(transport, stub.seenons_url, cache=cache)
+            hague_api = HagueAPI(transport, stub.hague_url)
+            catalogue = seenons_api.get_all_waste_streams()
+            stub.down = True
+            for _ in range(3):
+                self.assertEqual(seenons_api.get_all_waste_streams(), catalogue)
+            # Two failures opened the circuit, later requests fail fast
+            self.assertEqual(len(stub.requests), 3)
+            with self.assertRaises(CircuitOpenError):
+                hague_api.get_waste_streams("0518200001769844")
+            self.assertEqual(len(stub.requests), 3)
+
+    def test_half_open_trial_rate_limited(self):
+        # A 429 (or an unexpected error) answering the trial request must not wedge the circuit
+        statuses = [503, 429, 503, "error", 200]
+
+        class FakeSession:
+            def get(self, url, **kwargs):
+                status = statuses.pop(0)
+                if status == "error":
+                    raise ValueError("unexpected")
+                response = requests.Response()
+                response.status_code = status
+                return response
+
+        transport = Transport(
+            FakeSession(),
+            retries=0,
+            failure_threshold=1,
+            reset_timeout=0,
+            sleep=lambda seconds: None,
+        )
+        breaker = transport.breaker("example.com")
+        for error in [requests.HTTPError] * 3 + [ValueError]:
+            with self.assertRaises(error):
+                transport.get("http://example.com/")
+            self.assertFalse(breaker.trial)
+            self.assertTrue(breaker.is_open)
+        self.assertEqual(transport.get("http://example.com/").status_code, 200)
+        self.assertFalse(breaker.is_open)
+
+    def test_rate_limited_is_neutral(self):
+        # 429s between server errors neither count as failures nor reset them
+        with StubServer(faults=[503, 429, 503, 429]) as stub:
+            transport = Transport(
+                retries=0, failure_threshold=2, sleep=lambda seconds: None
+            )
+            for _ in range(3):
+                with self.assertRaises(requests.HTTPError):
+                    transport.get(stub.seenons_url)
+            breaker = transport.breaker(urlsplit(stub.seenons_url).netloc)
+            self.assertEqual(breaker.failures, 2)
+            self.assertTrue(breaker.is_open)
+            with self.assertRaises(CircuitOpenError):
+                transport.get(stub.seenons_url)
+
+    def test_overlapping_request_keeps_trial(self):
+        # A request sent before the circuit opened must not end the trial of another one
+        started = {path: threading.Event() for path in ["/slow", "/trial"]}
+        release = {path: threading.Event() for path in ["/slow", "/trial"]}
+        statuses = {"/slow": 503, "/fail": 503, "/trial": 200}
+
+        class FakeSession:
+            def get(self, url, **kwargs):
+                path = urlsplit(url).path
+                if path in started:
+                    started[path].set()
+                    release[path].wait(5)
+                response = requests.Response()
+                response.status_code = statuses[path]
+                return response
+
+        transport = Transport(
+            FakeSession(), retries=0, failure_threshold=1, reset_timeout=0
+        )
+        breaker = transport.breaker("example.com")
+        results = {}
+
+        def get(path):
+            try:
+                results[path] = transport.get("http://example.com" + path).status_code
+            except requests.RequestException as error:
+                results[path] = type(error)
+
+        threads = {path: threading.Thread(target=get, args=(path,)) for path in started}
+        threads["/slow"].start()
+        started["/slow"].wait(5)
+        get("/fail")
+        self.assertTrue(breaker.is_open)
+        threads["/trial"].start()
+        started["/trial"].wait(5)
+        release["/slow"].set()
+        threads["/slow"].join(5)
+        self.assertEqual(results["/slow"], requests.HTTPError)
+        # The trial is still running: no second trial is let through
+        self.assertTrue(breaker.trial)
+        with self.assertRaises(CircuitOpenError):
+            transport.get("http://example.com/other")
+        release["/trial"].set()
+        threads["/trial"].join(5)
+        self.assertEqual(results["/trial"], 200)
+        self.assertFalse(breaker.is_open)
+        self.assertFalse(breaker.trial)
+
+    def test_token_bucket(self):
+        now = [0.0]
+        sleeps = []
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            now[0] += seconds
+
+        bucket = TokenBucket(10, 2, clock=lambda: now[0], sleep=sleep)
+        for _ in range(4):
+            bucket.acquire()
+        self.assertEqual(len(sleeps), 2)
+        self.assertAlmostEqual(sum(sleeps), 0.2)
+
+
+class TestService(unittest.TestCase):
+    def setUp(self):
+        self.seenons_api = FakeSeenonsAPI()
+        self.hague_api = FakeHagueAPI()
+        service = AvailabilityService(self.seenons_api, self.hague_api)
+        service.warm_up()
+        self.client = create_app(service).test_client()
+
+    def test_availability(self):
+        for _ in range(3):
+            response = self.client.get(
+                "/availability?postcode=2512HE&number=68&letter=A&weekday=tuesday,Monday"
+            )
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["bagid"], "0518200001769844")
+        self.assertEqual([s["id"] for s in response.json["streams"]], [17, 3])
+        # Catalogue stays warm between requests, address lookups are not memoized
+        self.assertEqual(self.seenons_api.calls, {"all": 1, "postcode": 3})
+        self.assertEqual(self.hague_api.address_calls, 3)
+
+    def test_summary(self):
+        response = self.client.get(
+            "/availability?postcode=2512HE&number=68&letter=A&summary=1"
+        )
+        self.assertEqual(response.status_code, 200)
+        schedule = response.json["streams"][1]["schedule"]
+        self.assertEqual(schedule["weekday"], "Tuesday")
+        self.assertNotIn("dates", response.json["streams"][1])
+
+    def test_errors(self):
+        response = self.client.get("/availability?postcode=2512HE&number=34")
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json["error"], "Postal address does not exist")
+        response = self.client.get("/availability?postcode=2512HE")
+        self.assertEqual(response.status_code, 400)
+
+
+class TestSingleFlight(unittest.TestCase):
+    def test_threads_share_upstream_call(self):
+        with StubServer(delay=0.1) as stub:
+            hague_api = HagueAPI(base_url=stub.hague_url)
+            results = []
+            threads = [
+                threading.Thread(
+                    target=lambda: results.append(
+                        hague_api.get_dates_per_stream("0518200001769844")
+                    )
+                )
+                for _ in range(10)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(len(stub.requests), 1)
+        self.assertEqual(len(results), 10)
+        self.assertTrue(all(result is results[0] for result in results))
+
+    def test_tasks_share_upstream_call(self):
+        with StubServer(delay=0.1) as stub:
+
+            async def fetch():
+                async with create_session() as session:
+                    seenons_api = AsyncSeenonsAPI(session, stub.seenons_url)
+                    return await asyncio.gather(
+                        *[
+                            seenons_api.get_waste_streams_per_postcode("2512HE")
+                            for _ in range(10)
+                        ]
+                    )
+
+            results = asyncio.run(fetch())
+        self.assertEqual(len(stub.requests), 1)
+        self.assertEqual(results[0]["totalItems"], 3)
+
+
+class TestCalendarStore(unittest.TestCase):
+    def test_import_and_answer_offline(self):
+        store = CalendarStore(":memory:")
+        with StubServer() as stub:
+            count = import_calendars(
+                HagueAPI(base_url=stub.hague_url),
+                store,
+                ["2512HE:68", "2512HE:34", "0518200001769845"],
+            )
+        self.assertEqual(count, 3)
+        self.assertEqual(store.get_bagid("2512HE", "68", "B"), "0518200001769845")
+
+        hague_api = OfflineHagueAPI(store)
+        resolver = AddressResolver(FakeSeenonsAPI(), hague_api)
+        record = resolver.resolve("2512HE", "68", "A")
+        self.assertEqual([s["id"] for s in record["streams"]], [17, 3, 1])
+        self.assertEqual(
+            resolver.resolve("2512HE", "34")["error"], "Postal address does not exist"
+        )
+        # Only the fields used by the integration are stored
+        self.assertEqual(
+            hague_api.get_waste_streams("0518200001769844")[0],
+            {"id": 1, "title": "GFT"},
+        )
+        # Streamed calendars are read from the store as well
+        mapping = StreamMapping.from_seenons_streams(
+            load_fixture("seenons_streams.json")
+        )
+        streaming = AddressResolver(
+            FakeSeenonsAPI(), hague_api, stream_mapping=mapping, streaming=True
+        )
+        with mock.patch.object(
+            hague_api.transport, "get", side_effect=AssertionError("request sent")
+        ):
+            self.assertEqual(streaming.resolve("2512HE", "68", "A"), record)
+            entries = list(
+                hague_api.iter_dates_per_stream("0518200001769844", ("ophaaldatum",))
+            )
+        self.assertEqual(entries[0], {"ophaaldatum": "2022-01-03"})
+
+    def test_range_beyond_stored_years(self):
+        store = CalendarStore(":memory:")
+        store.put_addresses("2512HE", "68", load_fixture("adressen_2512HE_68.json"))
+        store.put_waste_streams("0518200001769844", load_fixture("afvalstromen.json"))
+        store.put_calendar("0518200001769844", 2022, load_fixture("kalender.json"))
+        hague_api = OfflineHagueAPI(store)
+        # A window crossing into a year that was not imported has no entries there
+        start, end = date(2022, 12, 20), date(2023, 1, 10)
+        hague_dates = hague_api.get_dates_in_range("0518200001769844", start, end)
+        self.assertTrue(hague_dates)
+        self.assertTrue(all(d["ophaaldatum"] <= "2022-12-31" for d in hague_dates))
+        self.assertEqual(
+            list(hague_api.iter_dates_in_range("0518200001769844", start, end)),
+            hague_dates,
+        )
+        with self.assertRaises(NotInStoreError):
+            hague_api.get_dates_in_range(
+                "0518200001769844", date(2024, 1, 1), date(2024, 2, 1)
+            )
+        # The service reports a missing calendar as such, not as an upstream failure
+        service = AvailabilityService(FakeSeenonsAPI(), hague_api)
+        client = create_app(service).test_client()
+        response = client.get(
+            "/availability?postcode=2512HE&number=68&letter=A&weeks=4"
+        )
+        self.assertEqual(response.status_code, 404)
+        self.assertIn("calendar stored", response.json["error"])
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_run_and_compare(self):
+        results = run(sizes=[1, 20], workers=4)
+        self.assertEqual(set(results["batch"]), {"1", "20"})
+        self.assertIn("add_weekday_to_hague_dates", results["stages"])
+        self.assertEqual(find_regressions(results, results), [])
+        slower = copy.deepcopy(results)
+        slower["batch"]["20"]["addresses_per_second"] /= 2
+        self.assertEqual(len(find_regressions(slower, results)), 1)
+
+
+class TestInstrumentation(unittest.TestCase):
+    def test_upstream_cache_and_stage_metrics(self):
+        metrics = MetricsSink()
+        instrumentation = Instrumentation([metrics])
+        with StubServer() as stub:
+            hague_api = HagueAPI(
+                base_url=stub.hague_url,
+                cache=ResponseCache(),
+                instrumentation=instrumentation,
+            )
+            hague_api.get_dates_per_stream("0518200001769844")
+            hague_dates = hague_api.get_dates_per_stream("0518200001769844")
+        Integration(instrumentation).add_weekday_to_hague_dates(hague_dates)
+        rendered = metrics.render()
+        self.assertIn(
+            'upstream_requests_total{endpoint="hague_kalender",status="200"} 1',
+            rendered,
+        )
+        self.assertIn(
+            'cache_requests_total{endpoint="hague_kalender",result="hit"} 1', rendered
+        )
+        self.assertIn(
+            'cache_requests_total{endpoint="hague_kalender",result="miss"} 1', rendered
+        )
+        self.assertIn(
+            'stage_seconds_count{stage="add_weekday_to_hague_dates"} 1', rendered
+        )
+
+    def test_stages_of_full_integration(self):
+        stages = []
+
+        class StageSink(Sink):
+            def record_stage(self, stage, seconds):
+                stages.append(stage)
+
+        Integration(Instrumentation([StageSink()])).get_available_streams(
+            load_fixture("afvalstromen.json"),
+            load_fixture("seenons_streams.json"),
+            load_fixture("kalender.json"),
+            [17, 1, 3],
+        )
+        self.assertEqual(stages, ["create_calendar_array", "create_availability_dict"])
+
+
+class TestRequestPlan(unittest.TestCase):
+    def test_one_call_per_resource(self):
+        with StubServer() as stub, mock.patch.multiple(
+            integration_cli,
+            HUISVUILKALENDAR=stub.hague_url,
+            SEENONS_BASE=stub.seenons_url,
+            choose_house_letter=lambda house_info: "A",
+        ):
+            with contextlib.redirect_stdout(io.StringIO()) as output:
+                integration_cli.main("2512HE", "68", ["Tuesday"])
+        # Five distinct documents, each fetched once. This is the floor: the catalogue cannot
+        # be replaced by the streams per postcode, because the last matching catalogue
+        # stream decides a title's ID (see StreamMapping), even when it is not offered there.
+        year = date.today().year
+        self.assertEqual(
+            sorted(stub.requests),
+            sorted(
+                [
+                    "/adressen/2512HE:68",
+                    "/api/me/streams",
+                    "/api/me/streams?postal_code=2512HE",
+                    "/rest/adressen/0518200001769844/afvalstromen",
+                    f"/rest/adressen/0518200001769844/kalender/{year}",
+                ]
+            ),
+        )
+        self.assertIn("restafval (ID: 3)", output.getvalue())
+
+    def test_modify_dates_is_read_only(self):
+        plan = integration_cli.RequestPlan()
+        with StubServer() as stub, mock.patch.multiple(
+            integration_cli,
+            HUISVUILKALENDAR=stub.hague_url,
+            SEENONS_BASE=stub.seenons_url,
+        ):
+            dates = integration_cli.modify_dates(
+                "0518200001769844", load_fixture("kalender.json"), plan
+            )
+            integration_cli.modify_dates("0518200001769844", dates, plan)
+        self.assertEqual(len(stub.requests), 2)
+        self.assertEqual(dates[0]["afvalstroom_id"], 17)
+        with self.assertRaises(TypeError):
+            dates[0]["afvalstroom_id"] = 1
+
+
+class TestJsonStream(unittest.TestCase):
+    def chunks(self, document, size):
+        data = json.dumps(document).encode()
+        return [data[start:][:size] for start in range(0, len(data), size)]
+
+    def test_items_in_small_chunks(self):
+        catalogue = load_fixture("seenons_streams.json")
+        catalogue["items"][0]["type"] = "gft-afval ë"
+        for size in (1, 7, 4096):
+            items = list(
+                iter_items(self.chunks(catalogue, size), "items", ("type", "size"))
+            )
+            self.assertEqual(
+                items,
+                [{"type": s["type"], "size": s["size"]} for s in catalogue["items"]],
+            )
+        # Root arrays of numbers split over chunks
+        self.assertEqual(list(iter_items(self.chunks([12345, 6], 2))), [12345, 6])
+        self.assertEqual(
+            list(iter_items([b'{"totalItems": 0, "items": []}'], "items")), []
+        )
+
+    def test_streaming_resolver(self):
+        with StubServer() as stub:
+            resolver = AddressResolver(
+                SeenonsAPI(base_url=stub.seenons_url),
+                HagueAPI(base_url=stub.hague_url),
+                streaming=True,
+            )
+            record = resolver.resolve("2512HE", "68", "A", ["Tuesday"])
+            expected = AddressResolver(
+                SeenonsAPI(base_url=stub.seenons_url),
+                HagueAPI(base_url=stub.hague_url),
+            ).resolve("2512HE", "68", "A", ["Tuesday"])
+        self.assertEqual(record, expected)
+
+
 if __name__ == "__main__":
-    tester = TestIntegration()
-
-    tester.test_1()
-    tester.test_2()
-    tester.test_3()
-    tester.test_4()
-    tester.test_5()
-    tester.test_6()
-    tester.test_7()
-    tester.test_8()
+    unittest.main()
@@ -0,0 +1,232 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+import requests
+
+# (connect, read) timeout in seconds of every upstream request.
+DEFAULT_TIMEOUT = (3.05, 15)
+DEFAULT_RETRIES = 3
+# Base and cap in seconds of the exponential backoff between retries.
+DEFAULT_BACKOFF = 0.25
+DEFAULT_MAX_BACKOFF = 10
+# Consecutive failures that open a host's circuit, and seconds until a trial request.
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_TIMEOUT = 30
+# Responses worth retrying: rate limited or a (temporary) server error.
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+
+class CircuitOpenError(requests.ConnectionError):
+    # Raised without contacting the host while its circuit is open.
+    pass
+
+
+class TokenBucket:
+    # Allows rate requests per second on average, with bursts of up to capacity requests.
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1, rate)
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = self.capacity
+        self.updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        # Take a token, waiting until one is available.
+        while True:
+            with self._lock:
+                now = self.clock()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            self.sleep(wait)
+
+
+class CircuitBreaker:
+    # Opens after failure_threshold consecutive failures, failing fast for reset_timeout
+    # seconds. Then a single trial request is let through (half open): its success closes
+    # the circuit, its failure opens it again.
+
+    def __init__(
+        self,
+        failure_threshold=DEFAULT_FAILURE_THRESHOLD,
+        reset_timeout=DEFAULT_RESET_TIMEOUT,
+        clock=time.monotonic,
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def allow(self):
+        # (allowed, trial): whether a request may be sent, and whether it is the trial request.
+        # Only the caller that got the trial records it as such and settles it.
+        with self._lock:
+            if self.opened_at is None:
+                return True, False
+            if self.trial or self.clock() - self.opened_at < self.reset_timeout:
+                return False, False
+            self.trial = True
+            return True, True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self, trial=False):
+        with self._lock:
+            self.failures += 1
+            if trial or self.failures >= self.failure_threshold:
+                self.opened_at = self.clock()
+
+    def settle(self):
+        # End the trial request once its outcome is recorded, or after an unexpected error,
+        # so the next request after reset_timeout is tried again while the circuit is open.
+        with self._lock:
+            self.trial = False
+
+
+def retry_after(response):
+    # Seconds to wait according to the Retry-After header (seconds or HTTP date), None without.
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class Transport:
+    # Sends the GET requests of the API clients: with connect / read timeouts, retries with
+    # jittered exponential backoff on connection errors, timeouts and 429 / 5xx responses
+    # (honouring Retry-After up to max_backoff), an optional token bucket rate limit and a
+    # circuit breaker per host. Share one Transport between API clients so they share the
+    # per-host limits and circuit state. Used like a session: get(url, headers, stream).
+
+    def __init__(
+        self,
+        session=None,
+        timeout=DEFAULT_TIMEOUT,
+        retries=DEFAULT_RETRIES,
+        backoff=DEFAULT_BACKOFF,
+        max_backoff=DEFAULT_MAX_BACKOFF,
+        rate=None,
+        burst=None,
+        failure_threshold=DEFAULT_FAILURE_THRESHOLD,
+        reset_timeout=DEFAULT_RESET_TIMEOUT,
+        sleep=time.sleep,
+    ):
+        self.session = session if session is not None else requests
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        # Requests per second per host (None for no limit), with bursts of burst requests.
+        self.rate = rate
+        self.burst = burst
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.sleep = sleep
+        self._lock = threading.Lock()
+        self._breakers = {}
+        self._buckets = {}
+
+    def breaker(self, host):
+        with self._lock:
+            if host not in self._breakers:
+                self._breakers[host] = CircuitBreaker(
+                    self.failure_threshold, self.reset_timeout
+                )
+            return self._breakers[host]
+
+    def bucket(self, host):
+        if self.rate is None:
+            return None
+        with self._lock:
+            if host not in self._buckets:
+                self._buckets[host] = TokenBucket(
+                    self.rate, self.burst, sleep=self.sleep
+                )
+            return self._buckets[host]
+
+    def delay(self, attempt, response=None):
+        # Full jitter exponential backoff, or the wait the server asked for.
+        wait = retry_after(response) if response is not None else None
+        if wait is None:
+            wait = random.uniform(0, self.backoff * 2**attempt)
+        return min(wait, self.max_backoff)
+
+    def get(self, url, headers=None, stream=False, on_retry=None):
+        # Send a GET request. Raises CircuitOpenError while the host's circuit is open, the
+        # last error once retries are exhausted, and HTTPError for a last 429 / 5xx response.
+        # on_retry is called before every retry.
+        host = urlsplit(url).netloc
+        breaker = self.breaker(host)
+        bucket = self.bucket(host)
+        attempt = 0
+        while True:
+            allowed, trial = breaker.allow()
+            if not allowed:
+                raise CircuitOpenError(f"Circuit open for {host}")
+            if bucket is not None:
+                bucket.acquire()
+            try:
+                response = self._attempt(
+                    breaker, trial, url, headers, stream, attempt >= self.retries
+                )
+            finally:
+                if trial:
+                    breaker.settle()
+            if response is not None and response.status_code not in RETRY_STATUSES:
+                return response
+            self.sleep(self.delay(attempt, response))
+            attempt += 1
+            if on_retry is not None:
+                on_retry()
+
+    def _attempt(self, breaker, trial, url, headers, stream, last):
+        # Send one request and record its outcome for the circuit. Returns the response, or
+        # None after a connection error or timeout. Failures of the last attempt are raised.
+        try:
+            response = self.session.get(
+                url, headers=headers, stream=stream, timeout=self.timeout
+            )
+        except (requests.ConnectionError, requests.Timeout):
+            breaker.record_failure(trial)
+            if last:
+                raise
+            return None
+        # Rate limiting says nothing about the host's health: a 429 neither counts as a failure
+        # nor resets the failures (a trial answered with one stays open and is settled).
+        if response.status_code not in RETRY_STATUSES:
+            breaker.record_success()
+        elif response.status_code != 429:
+            breaker.record_failure(trial)
+        if response.status_code not in RETRY_STATUSES:
+            return response
+        if last:
+            response.raise_for_status()
+        response.close()
+        return response
@@ -1,6 +1,13 @@
-import inquirer
 import argparse
-from integration_API import SeenonsAPI, HagueAPI, Integration
+import logging
+from integration_API import (
+    SeenonsAPI,
+    HagueAPI,
+    Integration,
+    AddressNotFoundError,
+    upcoming_window,
+)
+from instrumentation import Instrumentation, LoggingSink
 
 seenons_api = SeenonsAPI()
 hague_api = HagueAPI()
@@ -12,6 +19,9 @@ def choose_house_letter(house_info):
     letters = []
     # If house info contains more than one entry, prompt user to select house letter.
     if len(house_info) > 1:
+        # Only imported when prompting, so importing this module stays cheap.
+        import inquirer
+
         for item in house_info:
             letters.append(item["huisletter"])
         question = [
@@ -26,10 +36,14 @@ def choose_house_letter(house_info):
         return house_info[0]["huisletter"]
 
 
-def main(post_code, house_number, weekdays=None):
+def main(post_code, house_number, weekdays=None, weeks=None):
 
     # Get house info
-    house_info = hague_api.get_house_info(post_code, house_number)
+    try:
+        house_info = hague_api.get_house_info(post_code, house_number)
+    except AddressNotFoundError:
+        print("Postal address does not exist")
+        return
     print(house_info)
 
     # Get house letter
@@ -51,32 +65,32 @@ def main(post_code, house_number, weekdays=None):
         seenons_streams_per_postcode
     )
 
-    # Available dates per stream using Huisvuilkalendar API.
-    hague_stream_dates = hague_api.get_dates_per_stream(bag_id)
+    # Available dates per stream using Huisvuilkalendar API, only those of the coming weeks
+    # if asked (this fetches next year's calendar as well around December).
+    if weeks is not None:
+        start, end = upcoming_window(weeks)
+        hague_stream_dates = hague_api.get_dates_in_range(bag_id, start, end)
+    else:
+        hague_stream_dates = hague_api.get_dates_per_stream(bag_id)
 
     # Get waste streams from Huisvuilkalendar API fro given bag ID
     hague_available_streams = hague_api.get_waste_streams(bag_id)
 
-    # Modify stream dates fetched from the Hague API
-    hague_stream_dates = integration.modify_hague_stream_dates(
+    # Modify stream dates fetched from the Hague API into an array backed calendar
+    hague_calendar = integration.create_calendar_array(
         hague_available_streams, all_seenons_waste_streams, hague_stream_dates
     )
 
-    # Add weekday to hague API stream dates list
-    hague_stream_dates = integration.add_weekday_to_hague_dates(hague_stream_dates)
-
     # Check if weekdays are given by the user, if so filter out dates accordingly.
     if weekdays is not None:
         # Format weekdays list in case user has used wrong case
         weekdays = [weekday.capitalize() for weekday in weekdays]
-        # Need to filter Hague stream dates list to contain only weekdays asked by the user.
-        hague_stream_dates[:] = [
-            d for d in hague_stream_dates if d.get("weekday") in weekdays
-        ]
+        # Need to filter Hague calendar to contain only weekdays asked by the user.
+        hague_calendar = hague_calendar.filter_weekdays(weekdays)
 
     # Dictionary to save available waste stream data
     available_streams = integration.create_availability_dict(
-        hague_stream_dates, seenons_stream_ids
+        hague_calendar, seenons_stream_ids
     )
 
     # Visualise output
@@ -108,6 +122,26 @@ if __name__ == "__main__":
         help="Weekdays (Monday, Tuesday etc...)",
         required=False,
     )
+    parser.add_argument(
+        "-w",
+        "--weeks",
+        type=int,
+        help="Only show pickups in the coming number of weeks",
+        required=False,
+    )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        action="store_true",
+        help="Log upstream calls and integration stage timings",
+    )
     args = parser.parse_args()
 
-    main(args.postcode, args.housenumber, args.weekday)
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO, format="%(message)s")
+        instrumentation = Instrumentation([LoggingSink()])
+        seenons_api = SeenonsAPI(instrumentation=instrumentation)
+        hague_api = HagueAPI(instrumentation=instrumentation)
+        integration = Integration(instrumentation)
+
+    main(args.postcode, args.housenumber, args.weekday, args.weeks)